@@ -0,0 +1,52 @@
+"""
+Batched next board generation for many positions at once.
+
+Successors for every position are packed into one contiguous (total, 56)
+int8 array in the flattened CompactBoard layout, with an offsets index
+marking where each position's successors start, so they can be scored by
+the neural net in a single matrix multiply.
+"""
+
+import numpy as np
+
+from utility import swap_colors, CompactBoard
+from boards import generate_next_boards
+
+FLAT_BOARD_SIZE = 56
+
+
+def generate_next_boards_batch(boards, colors, rolls, mover_perspective=False):
+    """
+    Returns (successors, offsets) for the positions described by the
+    parallel lists <boards>, <colors> (is_black_turn flags) and <rolls>.
+
+    The successors of position i are successors[offsets[i]:offsets[i+1]], in
+    the same order generate_next_boards returns them.  With
+    <mover_perspective>, successors of black's positions are color swapped
+    so every row is seen from the side that moved (as the neural net scores
+    them).
+    """
+    assert len(boards) == len(colors) == len(rolls)
+    packed = bytearray()
+    offsets = np.zeros(len(boards) + 1, dtype=np.int64)
+    for i, (board, is_black_turn, roll) in enumerate(zip(boards, colors,
+                                                         rolls)):
+        if is_black_turn and mover_perspective:
+            next_boards = generate_next_boards(swap_colors(board), False, roll)
+        else:
+            next_boards = generate_next_boards(board, is_black_turn, roll)
+        for next_board in next_boards:
+            if isinstance(next_board, CompactBoard):
+                packed += next_board.flat
+            else:
+                packed += CompactBoard(next_board).flat
+        offsets[i+1] = offsets[i] + len(next_boards)
+    successors = np.frombuffer(packed, dtype=np.int8)
+    return successors.reshape(-1, FLAT_BOARD_SIZE), offsets
+
+def unpack_next_boards(successors, offsets, index):
+    """
+    Returns the successors of position <index> as a list of CompactBoards.
+    """
+    rows = successors[offsets[index]:offsets[index+1]]
+    return [CompactBoard.from_bytes(row.tobytes()) for row in rows]
@@ -0,0 +1,223 @@
+"""
+One-sided bear-off database.
+
+For every distribution of up to 15 checkers over the 6 home points the
+database holds the probability of bearing everything off in exactly n
+rolls (n = 0 .. MAX_ROLLS - 1), playing to minimize the expected number of
+rolls, and that expected number.  Once both sides are bearing off the game
+is a pure race, so two one-sided lookups give the win probability.
+
+File layout (little endian): a 16 byte header (magic 'GGBO', format
+version, checkers, MAX_ROLLS), the expected rolls (float32, one per
+position) and the roll distributions (float32, positions x MAX_ROLLS).
+Positions are in the order of home_positions().
+
+Usage: python bearoff.py [path] writes the database (about 7 MB, under a
+minute to build).  Needs numpy.
+"""
+import os
+import sys
+import struct
+
+import numpy as np
+
+from utility import BLACK_INDEX, WHITE_INDEX, can_bear_off, swap_colors
+
+CHECKERS = 15
+POINTS = 6
+MAX_ROLLS = 32
+MAGIC = b'GGBO'
+VERSION = 1
+HEADER = struct.Struct('<4sIII')
+HEADER_SIZE = 16
+DEFAULT_DATABASE_PATH = 'data/bearoff.db'
+
+# (dice, probability) of the 21 distinct rolls
+ROLLS = [([i, j] if i != j else [i, i, i, i], (1 if i == j else 2) / 36.0)
+         for i in range(1, 7) for j in range(i, 7)]
+
+
+class BearoffError(Exception):
+    pass
+
+
+def home_positions(checkers=CHECKERS):
+    """
+    Returns every home board of up to <checkers> checkers as a tuple of 6
+    counts, the checkers 1 to 6 pips from off, ordered by total pips (so
+    moves always lead to earlier positions).
+    """
+    def _positions(points, checkers):
+        if points == 0:
+            yield ()
+            return
+        for count in range(checkers + 1):
+            for rest in _positions(points - 1, checkers - count):
+                yield (count,) + rest
+    positions = list(_positions(POINTS, checkers))
+    positions.sort(key=lambda counts: (_pips(counts), counts))
+    return positions
+
+def _pips(counts):
+    return sum((point + 1)*count for point, count in enumerate(counts))
+
+def _apply_die(counts, die):
+    """
+    Returns the distinct home boards after playing one <die> from <counts>.
+    With no opposing checkers in the way every die can be played: exactly,
+    by moving a checker down, or by bearing off the rearmost checker.
+    """
+    occupied = [point for point in range(POINTS) if counts[point]]
+    if not occupied:
+        return [counts]
+    rearmost = occupied[-1]
+    results = []
+    for point in occupied:
+        target = point - die
+        if target < -1 and point != rearmost:
+            continue
+        next_counts = list(counts)
+        next_counts[point] -= 1
+        if target >= 0:
+            next_counts[target] += 1
+        results.append(tuple(next_counts))
+    return results
+
+def _successors(counts, dice, single_moves):
+    orders = [dice] if dice[0] == dice[-1] else [dice, dice[::-1]]
+    finals = set()
+    for order in orders:
+        states = set([counts])
+        for die in order:
+            next_states = set()
+            for state in states:
+                key = (state, die)
+                moves = single_moves.get(key)
+                if moves is None:
+                    moves = single_moves[key] = _apply_die(state, die)
+                next_states.update(moves)
+            states = next_states
+        finals.update(states)
+    return finals
+
+def generate_database(checkers=CHECKERS):
+    """
+    Returns (expected_rolls, distributions) arrays indexed like
+    home_positions(<checkers>).
+    """
+    positions = home_positions(checkers)
+    indexes = dict((counts, index) for index, counts in enumerate(positions))
+    expected_rolls = np.zeros(len(positions))
+    distributions = np.zeros((len(positions), MAX_ROLLS))
+    distributions[0, 0] = 1.0
+    single_moves = {}
+    for index in range(1, len(positions)):
+        distribution = distributions[index]
+        expected = 0.0
+        for dice, probability in ROLLS:
+            best = min((indexes[successor] for successor in
+                        _successors(positions[index], dice, single_moves)),
+                       key=expected_rolls.__getitem__)
+            expected += probability * expected_rolls[best]
+            distribution[1:] += probability * distributions[best, :-1]
+        expected_rolls[index] = 1 + expected
+    return expected_rolls, distributions
+
+def save_database(path, expected_rolls, distributions, checkers=CHECKERS):
+    header = HEADER.pack(MAGIC, VERSION, checkers, MAX_ROLLS)
+    with open(path, 'wb') as f:
+        f.write(header.ljust(HEADER_SIZE, b'\0'))
+        f.write(np.asarray(expected_rolls, dtype='<f4').tobytes())
+        f.write(np.asarray(distributions, dtype='<f4').tobytes())
+
+
+def is_bearoff_race(board):
+    """
+    True when both colors have every checker home (or off).
+    """
+    return can_bear_off(board) and can_bear_off(swap_colors(board))
+
+
+class BearoffDatabase(object):
+    """
+    Memory-mapped bear-off database written by save_database.  Pickles as
+    its path, so players holding one stay cheap to send to workers.
+    """
+    def __init__(self, path=DEFAULT_DATABASE_PATH):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise BearoffError('{} is truncated'.format(path))
+        magic, version, checkers, max_rolls = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise BearoffError('{} is not a bear-off database'.format(path))
+        if version != VERSION or max_rolls != MAX_ROLLS:
+            raise BearoffError('{} has unsupported version {}'.format(
+                    path, version))
+        positions = home_positions(checkers)
+        count = len(positions)
+        if os.path.getsize(path) != HEADER_SIZE + 4*count*(1 + MAX_ROLLS):
+            raise BearoffError('{} has the wrong size'.format(path))
+        data = np.memmap(path, dtype='<f4', mode='r', offset=HEADER_SIZE,
+                         shape=(count * (1 + MAX_ROLLS),))
+        self.checkers = checkers
+        self.expected = data[:count]
+        self.distributions = data[count:].reshape(count, MAX_ROLLS)
+        self.indexes = dict((counts, index) for index, counts
+                            in enumerate(positions))
+
+    def __getstate__(self):
+        return self.path
+
+    def __setstate__(self, path):
+        self.__init__(path)
+
+    def index(self, board, is_black):
+        """
+        Database index of the home board of black (if <is_black>) or white.
+        Raises KeyError for more checkers than the database holds.
+        """
+        if is_black:
+            counts = tuple(board[point][BLACK_INDEX] for point in range(6))
+        else:
+            counts = tuple(board[23 - point][WHITE_INDEX]
+                           for point in range(6))
+        return self.indexes[counts]
+
+    def expected_rolls(self, board, is_black):
+        return float(self.expected[self.index(board, is_black)])
+
+    def win_probability(self, board, is_black_turn):
+        """
+        Probability that the side to move wins the race on <board>.
+        """
+        mover = self.distributions[self.index(board, is_black_turn)]
+        other = self.distributions[self.index(board, not is_black_turn)]
+        # The mover wins if it needs no more rolls than the other side
+        other_needs_at_least = other[::-1].cumsum()[::-1]
+        return float(mover.dot(other_needs_at_least))
+
+    def best_move(self, is_black_turn, board_list):
+        """
+        Index of the next board in <board_list> that gives the side to move
+        the best chance of winning the race.
+        """
+        # There is no contact, so the opponent's home board is the same
+        # after every move and only the mover's distribution changes
+        other = self.distributions[self.index(board_list[0],
+                                              not is_black_turn)]
+        mover = self.distributions[[self.index(board, is_black_turn)
+                                    for board in board_list]]
+        mover_needs_at_least = mover[:, ::-1].cumsum(axis=1)[:, ::-1]
+        # Chance the opponent, rolling next, needs no more rolls
+        losing = mover_needs_at_least.dot(other)
+        return int(np.argmin(losing))
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_DATABASE_PATH
+    expected_rolls, distributions = generate_database()
+    save_database(path, expected_rolls, distributions)
+    print 'Wrote {} bear-off positions to {}'.format(len(expected_rolls),
+                                                      path)
@@ -1,123 +1,385 @@
-import copy
+import random
+from collections import OrderedDict, namedtuple
 
 from utility import (BLACK_INDEX, WHITE_INDEX, BLACK_BAR_INDEX,
                      WHITE_BAR_INDEX, BLACK_OFF_INDEX, WHITE_OFF_INDEX,
                      get_blank_board, get_initial_board, black_wins,
-                     white_wins, is_valid_board, roll_dice,
-                     can_bear_off, position_is_outer, swap_colors)
+                     white_wins, roll_dice, swap_colors, flatten_board,
+                     encode_board, decode_board, CompactBoard)
 
+DEFAULT_MOVE_CACHE_SIZE = 100000
+WHITE_HOME_START = 18
+
+_WHITE_BAR = 2*WHITE_BAR_INDEX + WHITE_INDEX
+_BLACK_BAR = 2*BLACK_BAR_INDEX + BLACK_INDEX
+
+MoveCacheInfo = namedtuple('MoveCacheInfo',
+                           ['hits', 'misses', 'maxsize', 'currsize'])
+
+SearchInfo = namedtuple('SearchInfo',
+                        ['searches', 'nodes_expanded', 'max_nodes_expanded'])
+
+
+class MoveCache(object):
+    """
+    Bounded LRU cache mapping a canonical board encoding (see
+    canonical_encoding) and sorted roll to the encoded, deduplicated next
+    boards.
+    """
+    def __init__(self, maxsize=DEFAULT_MOVE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.clear()
+
+    def clear(self):
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        try:
+            value = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self._entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def info(self):
+        return MoveCacheInfo(self.hits, self.misses, self.maxsize,
+                             len(self._entries))
+
+
+class SearchCounter(object):
+    """
+    Counts the search nodes expanded by generate_next_boards (cache misses
+    only).
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.searches = 0
+        self.nodes_expanded = 0
+        self.max_nodes_expanded = 0
+
+    def record(self, nodes_expanded):
+        self.searches += 1
+        self.nodes_expanded += nodes_expanded
+        self.max_nodes_expanded = max(self.max_nodes_expanded, nodes_expanded)
+
+    def info(self):
+        return SearchInfo(self.searches, self.nodes_expanded,
+                          self.max_nodes_expanded)
+
+
+_move_cache = MoveCache()
+_search_counter = SearchCounter()
+
+def set_move_cache_size(maxsize):
+    """
+    Resizes (and clears) the generate_next_boards cache.  A <maxsize> of 0
+    disables caching.
+    """
+    global _move_cache
+    _move_cache = MoveCache(maxsize)
+
+def clear_move_cache():
+    _move_cache.clear()
+
+def move_cache_info():
+    return _move_cache.info()
+
+def clear_search_info():
+    _search_counter.clear()
+
+def search_info():
+    """
+    Returns the number of searches run, the total search nodes they expanded
+    and the most nodes expanded by a single search.
+    """
+    return _search_counter.info()
 
 def generate_next_boards(board, is_black_turn, rolls):
     """ 
     Returns a list of all legal next boards given the initial
-    <board> and a list of rolls.
+    <board> and a list of rolls.  Next boards have the same type as <board>
+    (list of tuples or CompactBoard).
+
+    Results are memoized in a bounded LRU cache (see set_move_cache_size);
+    the cache holds immutable encodings so callers get fresh boards.
     """
     if is_black_turn:
         board = swap_colors(board)
-    final_boards = []
-    search_stack = []
-    # [board, rolls, rolls_used]
-    search_stack.append((board[:], rolls[:], []))
-    while search_stack:
-        board, rolls, used_rolls = search_stack.pop()
-        # Check to see if we're at a leaf node
-        if not rolls:
-            final_boards.append((board, used_rolls))
-            continue
-        # For each roll, get all possible boards
-        for i, roll in enumerate(rolls):
-            next_boards = _get_all_boards(board, roll)
-            next_rolls = rolls[:]
-            next_rolls.pop(i)
-            # Drop roll if it gives us no moves 
-            if not next_boards:
-                search_stack.append((board, next_rolls, used_rolls[:]))
-            # Explore all states after this roll with remaning rolls
-            for next_board in next_boards:
-                next_used_rolls = used_rolls[:]
-                next_used_rolls.append(roll)
-                search_stack.append((next_board, next_rolls, next_used_rolls))
-            # Don't explore all equivalent subtrees of doubles
-            if len(set(rolls)) == 1:
-                break
-    final_boards = _choose_maximal_moves(final_boards)
-    final_boards = _filter_equivalent_boards(final_boards)
+    if _move_cache.maxsize > 0:
+        final_boards = _generate_cached_boards(board, rolls)
+    else:
+        final_boards = _generate_boards(board, rolls)
     if is_black_turn:
         final_boards = [swap_colors(board) for board in final_boards]
     return final_boards
 
-def _choose_maximal_moves(final_boards):
+def _generate_cached_boards(board, rolls):
+    # <board> is already white to move, so its encoding is canonical
+    key = (encode_board(board), tuple(sorted(rolls)))
+    encoded_boards = _move_cache.get(key)
+    if encoded_boards is None:
+        final_boards = _generate_boards(board, rolls)
+        encoded_boards = tuple(encode_board(board) for board in final_boards)
+        _move_cache.put(key, encoded_boards)
+        return final_boards
+    compact = isinstance(board, CompactBoard)
+    return [decode_board(data, compact) for data in encoded_boards]
+
+def iter_next_boards(board, is_black_turn, rolls):
+    """
+    Generator version of generate_next_boards, yielding the legal,
+    deduplicated next boards as the search finds them so callers can stop
+    early.  Boards that use every die are legal as soon as they are found;
+    boards using fewer dice are only yielded (after applying the maximal
+    dice rules) if no board uses them all.  Bypasses the move cache.
+    """
+    if is_black_turn:
+        board = swap_colors(board)
+    compact = isinstance(board, CompactBoard)
+    for data in _iter_boards(board, rolls):
+        next_board = CompactBoard.from_bytes(data)
+        if not compact:
+            next_board = next_board.to_list()
+        if is_black_turn:
+            next_board = swap_colors(next_board)
+        yield next_board
+
+def sample_next_board(board, is_black_turn, rolls, rng=random):
+    """
+    Returns one of the boards generate_next_boards would return, drawn
+    uniformly at random with <rng>.
+
+    This is reservoir sampling over the full deduplicated search: every
+    distinct board is still found (so boards reached by more move orders
+    aren't drawn more often), and one is kept.  Bypasses the move cache.
+    """
+    if is_black_turn:
+        board = swap_colors(board)
+    compact = isinstance(board, CompactBoard)
+    chosen = None
+    for count, data in enumerate(_iter_boards(board, rolls), 1):
+        # Keep the count-th board with probability 1/count
+        if rng.random() * count < 1:
+            chosen = data
+    next_board = CompactBoard.from_bytes(chosen)
+    if not compact:
+        next_board = next_board.to_list()
+    if is_black_turn:
+        next_board = swap_colors(next_board)
+    return next_board
+
+def has_legal_move(board, is_black_turn, rolls):
+    """
+    Whether any checker can move with one of <rolls>, without searching.
+    """
+    if is_black_turn:
+        board = swap_colors(board)
+    state = GameState(board)
+    return any(state.checker_moves(roll) for roll in set(rolls))
+
+def _generate_boards(board, rolls):
+    """
+    Returns the legal, deduplicated next boards for white (see
+    _iter_boards).
+    """
+    if isinstance(board, CompactBoard):
+        return [CompactBoard.from_bytes(data)
+                for data in _iter_boards(board, rolls)]
+    return [CompactBoard.from_bytes(data).to_list()
+            for data in _iter_boards(board, rolls)]
+
+def _iter_boards(board, rolls):
+    """
+    Searches every ordering of <rolls> for white and yields the legal,
+    distinct next boards as byte strings.
+
+    The search walks a single GameState, making and unmaking checker moves
+    in place, and only copies the board at the leaves.  Transpositions are
+    merged: a search node is fully determined by its board, the dice left
+    and the dice used, so a node already seen with the same key is never
+    explored twice.  This collapses the different checker orders of
+    doubles into one subtree.
+    """
+    state = GameState(board)
+    # Search in one roll order, so the boards come out in the same order
+    # whichever way round the dice were given (and cached)
+    rolls = tuple(sorted(rolls))
+    # Doubles have a single ordering
+    if len(set(rolls)) == 1:
+        orders = [rolls]
+    else:
+        orders = [rolls, rolls[::-1]]
+    visited = set()
+    nodes_expanded = [0]
+
+    def search(order, depth, used_rolls):
+        """
+        Yields (board bytes, dice used, largest die used) per leaf.
+        """
+        if depth == len(order):
+            yield (bytes(state.flat), len(used_rolls),
+                   max(used_rolls) if used_rolls else 0)
+            return
+        nodes_expanded[0] += 1
+        roll = order[depth]
+        moves = state.checker_moves(roll)
+        # Drop roll if it gives us no moves
+        if not moves:
+            for leaf in search(order, depth + 1, used_rolls):
+                yield leaf
+            return
+        next_used_rolls = used_rolls + (roll,)
+        remaining_rolls = order[depth+1:]
+        for start, end in moves:
+            hit = state.apply_checker_move(start, end)
+            key = (bytes(state.flat), remaining_rolls, next_used_rolls)
+            if key not in visited:
+                visited.add(key)
+                for leaf in search(order, depth + 1, next_used_rolls):
+                    yield leaf
+            state.undo_checker_move(start, end, hit)
+
+    found = set()
+    # Leaves using fewer dice, in case none uses them all
+    partial_leaves = set()
+    try:
+        for order in orders:
+            for leaf in search(order, 0, ()):
+                if leaf[1] == len(rolls):
+                    if leaf[0] not in found:
+                        found.add(leaf[0])
+                        yield leaf[0]
+                elif not found:
+                    partial_leaves.add(leaf)
+        if not found:
+            for data in _choose_maximal_moves(partial_leaves):
+                yield data
+    finally:
+        _search_counter.record(nodes_expanded[0])
+
+def _choose_maximal_moves(leaves):
     """
     Filters out illegal transitions that are disallowed because they do not
-    use the maximum number of moves.
+    use the maximum number of moves, and returns the distinct boards left.
     """
     # You are forced to use the maximum number of dies as possible
-    max_moves = max(len(used_rolls) for (board, used_rolls) in final_boards)
-    final_boards = [(board, used_rolls)
-                    for (board, used_rolls) in final_boards
-                    if len(used_rolls) == max_moves]
+    max_moves = max(used for (data, used, largest) in leaves)
+    leaves = [leaf for leaf in leaves if leaf[1] == max_moves]
     # If you can choose between which die to use, you must use the greatest
     if max_moves == 1:
-        max_roll = max(max(used_rolls)
-                       for (board, used_rolls)
-                       in final_boards)
-        final_boards = [(board, used_rolls)
-                        for (board, used_rolls) in final_boards
-                        if max(used_rolls) == max_roll]
-    return final_boards
+        max_roll = max(largest for (data, used, largest) in leaves)
+        leaves = [leaf for leaf in leaves if leaf[2] == max_roll]
+    return set(data for (data, used, largest) in leaves)
 
-def _filter_equivalent_boards(final_boards):
-    """
-    Filters out duplicate boards.
-    """
-    final_boards = set(tuple(board) for (board, used_rolls) in final_boards)
-    return [list(board) for board in final_boards]
-
-def _get_all_boards(board, roll):
-    """
-    Generates a list of all legal next boards given <board> and a roll. 
-    Always assumes white is moving (swap_colors as necessary).
-    """
-    if board[WHITE_BAR_INDEX][WHITE_INDEX] > 0:
-        return _handle_bar_pieces(board, roll)
-    all_boards = []
-    for position, (black_count, white_count) in enumerate(board):
-        if position < 0 or position > 23:
-            continue
-        if white_count == 0:
-            continue
-        target = position + roll
-        if (target > 23 and 
-                can_bear_off(board) and position_is_outer(board, position)):
-            target = WHITE_OFF_INDEX
-        elif target == 24 and can_bear_off(board):
-            target = WHITE_OFF_INDEX
-        elif target > 23:
-            continue
-        new_board = _move_to_board_position(board, position, target)
-        if is_valid_board(new_board):
-            all_boards.append(new_board)
-    return all_boards
-
-def _handle_bar_pieces(board, roll):
-    """
-    Moves pieces off the bar.
-    """
-    target_index = -1 + roll
-    board = _move_to_board_position(board, WHITE_BAR_INDEX, target_index)
-    if is_valid_board(board):
-        return [board]
-    return []
-
-def _move_to_board_position(board, start, end):
-    board = board[:]
-    black_count, white_count = board[start]
-    board[start] = (black_count, white_count - 1)
-    black_end_count, white_end_count = board[end]
-    if black_end_count == 1:
-        board[end] = (0, white_end_count + 1)
-        bar_black_count, bar_white_count = board[BLACK_BAR_INDEX]
-        board[BLACK_BAR_INDEX] = (bar_black_count + 1, bar_white_count)
-    else:
-        board[end] = (black_end_count, white_end_count + 1)
-    return board
+
+class GameState(object):
+    """
+    Mutable search state with white to move: the flattened board (see
+    CompactBoard), the number of white checkers outside the home board
+    (bar included) and the rearmost point holding a white checker (24 if
+    none, bar not included).  apply_checker_move changes it in place and
+    undo_checker_move puts it back, so a search needs no board copies.
+    """
+    __slots__ = ('flat', 'outside_home', 'rearmost')
+
+    def __init__(self, board):
+        self.flat = bytearray(flatten_board(board))
+        self.outside_home = (self.flat[_WHITE_BAR] +
+                             sum(self.flat[WHITE_INDEX:2*WHITE_HOME_START:2]))
+        self.rearmost = self._next_occupied(0)
+
+    def can_bear_off(self):
+        return self.outside_home == 0
+
+    def _next_occupied(self, position):
+        flat = self.flat
+        while position < 24 and flat[2*position+1] == 0:
+            position += 1
+        return position
+
+    def checker_moves(self, roll):
+        """
+        Returns the legal (start, end) moves of a single white checker by
+        <roll>.  Checkers on the bar have to enter first.
+        """
+        flat = self.flat
+        if flat[_WHITE_BAR] > 0:
+            target = roll - 1
+            if flat[2*target] > 1:
+                return []
+            return [(WHITE_BAR_INDEX, target)]
+        moves = []
+        bearing_off = self.can_bear_off()
+        rearmost = self.rearmost
+        for position in range(rearmost, 24):
+            if flat[2*position+1] == 0:
+                continue
+            target = position + roll
+            if target > 23:
+                if not bearing_off:
+                    break
+                # Only the rearmost checker may bear off with a higher roll
+                if target != 24 and position != rearmost:
+                    continue
+                target = WHITE_OFF_INDEX
+            elif flat[2*target] > 1:
+                continue
+            moves.append((position, target))
+        return moves
+
+    def apply_checker_move(self, start, end):
+        """
+        Moves one white checker from <start> to <end>, hitting a lone black
+        checker on <end>.  Returns whether it hit, for undo_checker_move.
+        """
+        flat = self.flat
+        flat[2*start+1] -= 1
+        hit = flat[2*end] == 1
+        if hit:
+            flat[2*end] = 0
+            flat[_BLACK_BAR] += 1
+        flat[2*end+1] += 1
+        if start < WHITE_HOME_START or start == WHITE_BAR_INDEX:
+            self.outside_home -= 1
+        if end < WHITE_HOME_START:
+            self.outside_home += 1
+        # Entering from the bar can land behind the rearmost checker; any
+        # other move can only empty it
+        if end < self.rearmost:
+            self.rearmost = end
+        elif start == self.rearmost and flat[2*start+1] == 0:
+            self.rearmost = self._next_occupied(start + 1)
+        return hit
+
+    def undo_checker_move(self, start, end, hit):
+        """
+        Reverts apply_checker_move(<start>, <end>), which returned <hit>.
+        """
+        flat = self.flat
+        flat[2*end+1] -= 1
+        if hit:
+            flat[2*end] = 1
+            flat[_BLACK_BAR] -= 1
+        flat[2*start+1] += 1
+        if start < WHITE_HOME_START or start == WHITE_BAR_INDEX:
+            self.outside_home += 1
+        if end < WHITE_HOME_START:
+            self.outside_home -= 1
+        if start < self.rearmost:
+            self.rearmost = start
+        elif end == self.rearmost and flat[2*end+1] == 0:
+            self.rearmost = self._next_occupied(end + 1)
+
+    def to_board(self):
+        return CompactBoard.from_bytes(self.flat)
@@ -0,0 +1,76 @@
+"""
+Seeded dice streams.
+
+A DiceStream rolls from its own NumPy RandomState, BLOCK_SIZE rolls at a
+time, so a game's dice depend only on the stream's seed and not on the
+process playing it or on anything else drawing from the global RNG.
+replay() starts the same sequence over, so both games of a duplicate pair
+can be played with the same dice, and spawn() derives independent streams
+for each game or worker from one seed.  Needs numpy.
+"""
+import random
+
+import numpy as np
+
+BLOCK_SIZE = 1024
+
+
+class DiceStream(object):
+    """
+    Rolls like utility.roll_dice, from <seed> (an int or a tuple of ints,
+    random if None).
+    """
+    def __init__(self, seed=None, block_size=BLOCK_SIZE):
+        if seed is None:
+            seed = random.randint(0, 2**31)
+        self.seed = seed
+        self.block_size = block_size
+        # Separate generators for the rolls and the first turns, so neither
+        # depends on how the other is drawn (or on the block size)
+        seed = _seed_tuple(seed)
+        self._rng = np.random.RandomState(seed + (0,))
+        self._first_turns = np.random.RandomState(seed + (1,))
+        self._rolls = []
+        self._next = 0
+
+    def roll(self):
+        """
+        Returns the next roll: a 2 element list (or 4 in the case of
+        doubles).
+        """
+        if self._next == len(self._rolls):
+            self._rolls = self._generate_block()
+            self._next = 0
+        roll = self._rolls[self._next]
+        self._next += 1
+        return roll
+
+    def black_starts(self):
+        """
+        Draws who moves first in a game.
+        """
+        return bool(self._first_turns.randint(2))
+
+    def _generate_block(self):
+        dice = self._rng.randint(1, 7, size=(self.block_size, 2)).tolist()
+        return [[die1, die2] if die1 != die2 else [die1]*4
+                for die1, die2 in dice]
+
+    def replay(self):
+        """
+        Returns a new stream that rolls the same dice as this one did from
+        the start.
+        """
+        return DiceStream(self.seed, self.block_size)
+
+    def spawn(self, index):
+        """
+        Returns the stream numbered <index> derived from this one's seed
+        (the same for the same seed and <index>, independent of the rolls
+        drawn so far).
+        """
+        return DiceStream(_seed_tuple(self.seed) + (index,), self.block_size)
+
+
+def _seed_tuple(seed):
+    return seed if isinstance(seed, tuple) else (seed,)
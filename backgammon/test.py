@@ -1,11 +1,31 @@
+import os
+import pickle
+import random
+import shutil
+import tempfile
 import unittest
 
 from utility import (BLACK_INDEX, WHITE_INDEX, BLACK_BAR_INDEX,
                      WHITE_BAR_INDEX, BLACK_OFF_INDEX, WHITE_OFF_INDEX,
                      get_blank_board, get_initial_board, black_wins,
                      white_wins, is_valid_board, roll_dice,
-                     can_bear_off, position_is_outer, swap_colors)
-from boards import generate_next_boards
+                     can_bear_off, position_is_outer, swap_colors,
+                     flatten_board, encode_board, decode_board,
+                     canonical_encoding, CompactBoard)
+from boards import (generate_next_boards, set_move_cache_size,
+                    clear_move_cache, move_cache_info,
+                    clear_search_info, search_info,
+                    DEFAULT_MOVE_CACHE_SIZE, GameState, iter_next_boards,
+                    sample_next_board, has_legal_move,
+                    _choose_maximal_moves)
+from dice import DiceStream
+from batch import generate_next_boards_batch, unpack_next_boards
+from bearoff import (generate_database, save_database, is_bearoff_race,
+                     BearoffDatabase, BearoffError)
+
+
+ALL_ROLLS = [[i, j] if i != j else [i, i, i, i]
+             for i in range(1, 7) for j in range(i, 7)]
 
 
 class TestUtilities(unittest.TestCase):
@@ -61,6 +81,8 @@ class TestUtilities(unittest.TestCase):
 
 
 class TestBackgammonRules(unittest.TestCase):
+    generate_next_boards = staticmethod(generate_next_boards)
+
     def test_move_prioritization(self):
         """
         Ensure we don't return:
@@ -74,7 +96,7 @@ class TestBackgammonRules(unittest.TestCase):
         board[4] = (15,0)
         self.assertTrue(is_valid_board(board))
         roll = [2,1]
-        next_boards = generate_next_boards(board, False, roll)
+        next_boards = self.generate_next_boards(board, False, roll)
         self.assertEqual(len(next_boards), 2)
         board1 = get_blank_board()
         board1[2]= (0,13)
@@ -94,13 +116,13 @@ class TestBackgammonRules(unittest.TestCase):
         board[23] = (0, 15)
         self.assertTrue(is_valid_board(board))
         roll = [2,1]
-        next_boards = generate_next_boards(board, True, roll)
+        next_boards = self.generate_next_boards(board, True, roll)
         self.assertEqual(len(next_boards), 1)
         self.assertEqual(next_boards[0][BLACK_BAR_INDEX], (14, 0))
         self.assertEqual(next_boards[0][23], (0, 15))
         self.assertEqual(next_boards[0][22], (1, 0))
         roll = [1,1,1,1]
-        next_boards = generate_next_boards(board, True, roll)
+        next_boards = self.generate_next_boards(board, True, roll)
         self.assertEqual(len(next_boards), 1)
         self.assertEqual(next_boards[0][BLACK_BAR_INDEX], (15, 0))
         self.assertEqual(next_boards[0][23], (0, 15))
@@ -111,13 +133,13 @@ class TestBackgammonRules(unittest.TestCase):
         board[0] = (15, 0)
         self.assertTrue(is_valid_board(board))
         roll = [2,1]
-        next_boards = generate_next_boards(board, False, roll)
+        next_boards = self.generate_next_boards(board, False, roll)
         self.assertEqual(len(next_boards), 1)
         self.assertEqual(next_boards[0][WHITE_BAR_INDEX], (0, 14))
         self.assertEqual(next_boards[0][0], (15, 0))
         self.assertEqual(next_boards[0][1], (0, 1))
         roll = [1,1,1,1]
-        next_boards = generate_next_boards(board, False, roll)
+        next_boards = self.generate_next_boards(board, False, roll)
         self.assertEqual(len(next_boards), 1)
         self.assertEqual(next_boards[0][WHITE_BAR_INDEX], (0, 15))
         self.assertEqual(next_boards[0][0], (15, 0))
@@ -128,7 +150,7 @@ class TestBackgammonRules(unittest.TestCase):
         board[22] = (0,15)
         board[3] = (14,0)
         roll = [1,1,1,1]
-        next_boards = generate_next_boards(board, False, roll)
+        next_boards = self.generate_next_boards(board, False, roll)
         self.assertEqual(len(next_boards), 3)
         for next_board in next_boards:
             self.assertEqual(next_board[BLACK_BAR_INDEX], (1,0))
@@ -139,7 +161,7 @@ class TestBackgammonRules(unittest.TestCase):
         board[2] = (15,0)
         board[3] = (0,14)
         roll = [1,1,1,1]
-        next_boards = generate_next_boards(board, True, roll)
+        next_boards = self.generate_next_boards(board, True, roll)
         self.assertEqual(len(next_boards), 4)
         for next_board in next_boards:
             self.assertEqual(next_board[WHITE_BAR_INDEX], (0,1))
@@ -149,7 +171,7 @@ class TestBackgammonRules(unittest.TestCase):
         board[1] = (0,15)
         board[2] = (15,0)
         roll = [1,1,1,1]
-        next_boards = generate_next_boards(board, True, roll)
+        next_boards = self.generate_next_boards(board, True, roll)
         self.assertEqual(len(next_boards), 1)
         self.assertEqual(next_boards[0][1], (0,15))
         self.assertEqual(next_boards[0][2], (15,0))
@@ -160,12 +182,12 @@ class TestBackgammonRules(unittest.TestCase):
         board[0] = (15,0)
         self.assertTrue(is_valid_board(board))
         roll = [1]
-        next_boards = generate_next_boards(board, True, roll)
+        next_boards = self.generate_next_boards(board, True, roll)
         self.assertEqual(len(next_boards), 1)
         self.assertEqual(next_boards[0][0], (14, 0))
         self.assertEqual(next_boards[0][BLACK_OFF_INDEX], (1, 0))
         roll = [2]
-        next_boards = generate_next_boards(board, True, roll)
+        next_boards = self.generate_next_boards(board, True, roll)
         self.assertEqual(len(next_boards), 1)
         self.assertEqual(next_boards[0][0], (14, 0))
         self.assertEqual(next_boards[0][BLACK_OFF_INDEX], (1, 0))
@@ -173,7 +195,7 @@ class TestBackgammonRules(unittest.TestCase):
         board[10] = (0,15)
         board[1] = (15,0)
         roll = [3,1]
-        next_boards = generate_next_boards(board, True, roll)
+        next_boards = self.generate_next_boards(board, True, roll)
         self.assertEqual(len(next_boards), 1)
         self.assertEqual(next_boards[0][0], (1, 0))
         self.assertEqual(next_boards[0][1], (13, 0))
@@ -186,12 +208,12 @@ class TestBackgammonRules(unittest.TestCase):
         board[23] = (0,15)
         self.assertTrue(is_valid_board(board))
         roll = [1]
-        next_boards = generate_next_boards(board, False, roll)
+        next_boards = self.generate_next_boards(board, False, roll)
         self.assertEqual(len(next_boards), 1)
         self.assertEqual(next_boards[0][23], (0, 14))
         self.assertEqual(next_boards[0][WHITE_OFF_INDEX], (0, 1))
         roll = [2]
-        next_boards = generate_next_boards(board, False, roll)
+        next_boards = self.generate_next_boards(board, False, roll)
         self.assertEqual(len(next_boards), 1)
         self.assertEqual(next_boards[0][23], (0, 14))
         self.assertEqual(next_boards[0][WHITE_OFF_INDEX], (0, 1))
@@ -199,7 +221,7 @@ class TestBackgammonRules(unittest.TestCase):
         board[10] = (15,0)
         board[22] = (0,15)
         roll = [3,1]
-        next_boards = generate_next_boards(board, False, roll)
+        next_boards = self.generate_next_boards(board, False, roll)
         self.assertEqual(len(next_boards), 1)
         self.assertEqual(next_boards[0][23], (0, 1))
         self.assertEqual(next_boards[0][22], (0, 13))
@@ -211,7 +233,7 @@ class TestBackgammonRules(unittest.TestCase):
         board[1] = (1,0)
         board[3] = (14,0)
         roll = [2,2,2,2]
-        next_boards = generate_next_boards(board, False, roll)
+        next_boards = self.generate_next_boards(board, False, roll)
         board[WHITE_BAR_INDEX] = (0,11)
         board[1] = (0,4)
         board[BLACK_BAR_INDEX] = (1,0)
@@ -223,7 +245,7 @@ class TestBackgammonRules(unittest.TestCase):
         board[23] = (0,1)
         board[0] = (0,14)
         roll = [1,1,1,1]
-        next_boards = generate_next_boards(board, True, roll)
+        next_boards = self.generate_next_boards(board, True, roll)
         board[BLACK_BAR_INDEX] = (11,0)
         board[23] = (4,0)
         board[WHITE_BAR_INDEX] = (0,1)
@@ -242,7 +264,7 @@ class TestBackgammonRules(unittest.TestCase):
         board[3] = (1,0)
         board[1] = (0,1)
         roll = [2,3]
-        next_boards = generate_next_boards(board, False, roll)
+        next_boards = self.generate_next_boards(board, False, roll)
         self.assertEqual(len(next_boards), 1)
         board[1] = (0,0)
         board[4] = (0,1)
@@ -289,5 +311,554 @@ class TestBackgammonRules(unittest.TestCase):
         self.assertEqual(board[BLACK_OFF_INDEX], (0,0))
 
 
+def reference_next_boards(board, is_black_turn, rolls):
+    """
+    Plain search on the GameState engine: walks every ordering of every
+    checker move without merging transpositions, yielding early or caching,
+    so the search optimizations in boards.py can be checked against it.
+    """
+    if is_black_turn:
+        board = swap_colors(board)
+    state = GameState(board)
+    leaves = set()
+
+    def search(rolls, used_rolls):
+        if not rolls:
+            leaves.add((bytes(state.flat), len(used_rolls),
+                        max(used_rolls) if used_rolls else 0))
+            return
+        for i, roll in enumerate(rolls):
+            moves = state.checker_moves(roll)
+            next_rolls = rolls[:i] + rolls[i+1:]
+            if not moves:
+                search(next_rolls, used_rolls)
+            for start, end in moves:
+                hit = state.apply_checker_move(start, end)
+                search(next_rolls, used_rolls + (roll,))
+                state.undo_checker_move(start, end, hit)
+            # Don't explore all equivalent subtrees of doubles
+            if len(set(rolls)) == 1:
+                break
+
+    search(tuple(rolls), ())
+    final_boards = [CompactBoard.from_bytes(data)
+                    for data in _choose_maximal_moves(leaves)]
+    if not isinstance(board, CompactBoard):
+        final_boards = [final_board.to_list() for final_board in final_boards]
+    if is_black_turn:
+        final_boards = [swap_colors(final_board)
+                        for final_board in final_boards]
+    return final_boards
+
+
+class TestReferenceSearch(TestBackgammonRules):
+    generate_next_boards = staticmethod(reference_next_boards)
+
+    def test_matches_boards(self):
+        set_move_cache_size(0)
+        try:
+            random.seed(0)
+            for game in range(10):
+                board = CompactBoard(get_initial_board())
+                is_black_turn = game % 2 == 0
+                while not black_wins(board) and not white_wins(board):
+                    roll = roll_dice()
+                    expected = generate_next_boards(board, is_black_turn, roll)
+                    actual = self.generate_next_boards(board, is_black_turn,
+                                                       roll)
+                    self.assertEqual(set(actual), set(expected))
+                    self.assertEqual(len(actual), len(expected))
+                    board = random.choice(actual)
+                    is_black_turn = not is_black_turn
+        finally:
+            set_move_cache_size(DEFAULT_MOVE_CACHE_SIZE)
+
+
+class TestCompactBoard(unittest.TestCase):
+    def test_round_trip(self):
+        board = get_initial_board()
+        compact = CompactBoard(board)
+        self.assertEqual(compact.to_list(), board)
+        self.assertEqual(compact, board)
+        self.assertEqual(list(compact), board)
+        self.assertEqual(CompactBoard.from_bytes(compact.to_bytes()), compact)
+        self.assertEqual(compact[18], (0, 5))
+        compact[18] = (0, 4)
+        self.assertNotEqual(compact, board)
+
+    def test_pickle(self):
+        compact = CompactBoard(get_initial_board())
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            self.assertEqual(pickle.loads(pickle.dumps(compact, protocol)),
+                             compact)
+
+    def test_hash(self):
+        compact = CompactBoard(get_initial_board())
+        self.assertEqual(hash(compact), hash(compact.copy()))
+        self.assertEqual(len(set([compact, compact.copy()])), 1)
+
+    def test_flatten(self):
+        board = get_initial_board()
+        self.assertEqual(list(flatten_board(CompactBoard(board))),
+                         flatten_board(board))
+        self.assertEqual(CompactBoard(board).as_array().shape, (28, 2))
+
+    def test_utilities(self):
+        board = get_initial_board()
+        board[BLACK_OFF_INDEX] = (2, 0)
+        board[5] = (3, 0)
+        board[WHITE_BAR_INDEX] = (0, 1)
+        board[0] = (0, 1)
+        compact = CompactBoard(board)
+        self.assertTrue(is_valid_board(compact))
+        self.assertEqual(swap_colors(compact), swap_colors(board))
+        self.assertEqual(swap_colors(swap_colors(compact)), compact)
+        compact[0] = (1, 1)
+        compact[5] = (2, 0)
+        self.assertFalse(is_valid_board(compact))
+
+    def test_generate_next_boards(self):
+        set_move_cache_size(0)
+        try:
+            board = get_initial_board()
+            compact = CompactBoard(board)
+            for is_black_turn in [True, False]:
+                for roll in ALL_ROLLS:
+                    expected = generate_next_boards(board, is_black_turn, roll)
+                    actual = generate_next_boards(compact, is_black_turn, roll)
+                    for next_board in actual:
+                        self.assertTrue(isinstance(next_board, CompactBoard))
+                    self.assertEqual(sorted(b.to_list() for b in actual),
+                                     sorted(expected))
+        finally:
+            set_move_cache_size(DEFAULT_MOVE_CACHE_SIZE)
+
+
+class TestGameState(unittest.TestCase):
+    def test_apply_and_undo(self):
+        board = get_initial_board()
+        board[0] = (0, 1)
+        board[WHITE_BAR_INDEX] = (0, 1)
+        board[3] = (1, 0)
+        board[5] = (4, 0)
+        state = GameState(board)
+        self.assertEqual(state.checker_moves(4), [(WHITE_BAR_INDEX, 3)])
+        self.assertEqual(state.checker_moves(6), [])
+        hit = state.apply_checker_move(WHITE_BAR_INDEX, 3)
+        self.assertTrue(hit)
+        self.assertEqual(state.to_board()[3], (0, 1))
+        self.assertEqual(state.to_board()[BLACK_BAR_INDEX], (1, 0))
+        self.assertTrue(is_valid_board(state.to_board()))
+        state.undo_checker_move(WHITE_BAR_INDEX, 3, hit)
+        self.assertEqual(state.to_board(), board)
+
+    def test_bear_off(self):
+        board = get_blank_board()
+        board[20] = (0, 2)
+        board[22] = (0, 1)
+        board[WHITE_OFF_INDEX] = (0, 12)
+        board[BLACK_OFF_INDEX] = (15, 0)
+        state = GameState(board)
+        self.assertTrue(state.can_bear_off())
+        # Only the rearmost checker bears off with a 6
+        self.assertEqual(state.checker_moves(6), [(20, WHITE_OFF_INDEX)])
+        self.assertEqual(state.checker_moves(2),
+                         [(20, 22), (22, WHITE_OFF_INDEX)])
+        state.apply_checker_move(20, WHITE_OFF_INDEX)
+        self.assertEqual(state.to_board()[WHITE_OFF_INDEX], (0, 13))
+        state.undo_checker_move(20, WHITE_OFF_INDEX, False)
+        self.assertEqual(state.to_board(), board)
+
+    def test_random_walk(self):
+        board = CompactBoard(get_initial_board())
+        state = GameState(board)
+        for i in range(200):
+            moves = [move for roll in range(1, 7)
+                     for move in state.checker_moves(roll)]
+            if not moves:
+                break
+            start, end = random.choice(moves)
+            before = state.to_board()
+            outside_home = state.outside_home
+            hit = state.apply_checker_move(start, end)
+            self.assertTrue(is_valid_board(state.to_board()))
+            if random.random() < .5:
+                state.undo_checker_move(start, end, hit)
+                self.assertEqual(state.to_board(), before)
+                self.assertEqual(state.outside_home, outside_home)
+            fresh = GameState(state.to_board())
+            self.assertEqual(state.outside_home, fresh.outside_home)
+            self.assertEqual(state.rearmost, fresh.rearmost)
+
+    def test_rearmost(self):
+        board = get_blank_board()
+        board[WHITE_BAR_INDEX] = (0, 1)
+        board[10] = (0, 14)
+        board[BLACK_OFF_INDEX] = (15, 0)
+        state = GameState(board)
+        self.assertEqual(state.rearmost, 10)
+        state.apply_checker_move(WHITE_BAR_INDEX, 3)
+        self.assertEqual(state.rearmost, 3)
+        state.apply_checker_move(3, 5)
+        self.assertEqual(state.rearmost, 5)
+        state.undo_checker_move(3, 5, False)
+        self.assertEqual(state.rearmost, 3)
+        state.undo_checker_move(WHITE_BAR_INDEX, 3, False)
+        self.assertEqual(state.rearmost, 10)
+        self.assertEqual(state.to_board(), board)
+
+
+class TestIterNextBoards(unittest.TestCase):
+    def test_matches_generate_next_boards(self):
+        for game in range(5):
+            board = CompactBoard(get_initial_board())
+            is_black_turn = random.choice([True, False])
+            while not black_wins(board) and not white_wins(board):
+                roll = roll_dice()
+                expected = generate_next_boards(board, is_black_turn, roll)
+                actual = list(iter_next_boards(board, is_black_turn, roll))
+                self.assertEqual(len(actual), len(set(actual)))
+                self.assertEqual(set(actual), set(expected))
+                self.assertEqual(has_legal_move(board, is_black_turn, roll),
+                                 expected != [board])
+                board = random.choice(expected)
+                is_black_turn = not is_black_turn
+
+    def test_early_exit(self):
+        board = get_initial_board()
+        clear_move_cache()
+        clear_search_info()
+        boards = iter_next_boards(board, False, [3, 3, 3, 3])
+        first = next(boards)
+        self.assertTrue(is_valid_board(first))
+        self.assertTrue(isinstance(first, list))
+        boards.close()
+        early = search_info().nodes_expanded
+        clear_search_info()
+        generate_next_boards(board, False, [3, 3, 3, 3])
+        # The first board comes straight down one branch of the search
+        self.assertEqual(early, 4)
+        self.assertTrue(search_info().nodes_expanded > 10 * early)
+
+    def test_fewer_dice(self):
+        # White can only enter from the bar with the 6, then is stuck
+        board = get_blank_board()
+        board[WHITE_BAR_INDEX] = (0, 1)
+        board[23] = (0, 14)
+        for point in range(5):
+            board[point] = (2, 0)
+        board[BLACK_OFF_INDEX] = (5, 0)
+        self.assertTrue(is_valid_board(board))
+        self.assertEqual(list(iter_next_boards(board, False, [6, 1])),
+                         generate_next_boards(board, False, [6, 1]))
+        self.assertEqual(len(list(iter_next_boards(board, False, [6, 1]))), 1)
+        self.assertFalse(has_legal_move(board, False, [2, 1]))
+        self.assertEqual(list(iter_next_boards(board, False, [2, 1])), [board])
+
+
+class TestSampleNextBoard(unittest.TestCase):
+    def test_uniform(self):
+        rng = random.Random(0)
+        for is_black_turn, roll in [(False, [3, 1]), (True, [2, 2, 2, 2])]:
+            board = CompactBoard(get_initial_board())
+            expected = generate_next_boards(board, is_black_turn, roll)
+            counts = dict((next_board, 0) for next_board in expected)
+            draws = 200 * len(expected)
+            for i in range(draws):
+                next_board = sample_next_board(board, is_black_turn, roll, rng)
+                self.assertTrue(isinstance(next_board, CompactBoard))
+                counts[next_board] += 1
+            # Each count has a standard deviation of about 14
+            self.assertEqual(len(counts), len(expected))
+            for count in counts.values():
+                self.assertTrue(120 < count < 280)
+
+    def test_legal(self):
+        for game in range(3):
+            board = get_initial_board()
+            is_black_turn = random.choice([True, False])
+            while not black_wins(board) and not white_wins(board):
+                roll = roll_dice()
+                next_board = sample_next_board(board, is_black_turn, roll)
+                self.assertTrue(isinstance(next_board, list))
+                self.assertTrue(next_board in
+                                generate_next_boards(board, is_black_turn,
+                                                     roll))
+                board = next_board
+                is_black_turn = not is_black_turn
+
+    def test_fewer_dice(self):
+        # White must enter with the 6 and then cannot play the 1
+        board = get_blank_board()
+        board[WHITE_BAR_INDEX] = (0, 1)
+        board[23] = (0, 14)
+        for point in range(5):
+            board[point] = (2, 0)
+        board[BLACK_OFF_INDEX] = (5, 0)
+        self.assertEqual([sample_next_board(board, False, [6, 1])],
+                         generate_next_boards(board, False, [6, 1]))
+        self.assertEqual(sample_next_board(board, False, [2, 1]), board)
+
+
+class TestDiceStream(unittest.TestCase):
+    def test_seeded(self):
+        def draw(dice, first_turn_every):
+            first_turns = []
+            rolls = []
+            for i in range(25):
+                if i % first_turn_every == 0:
+                    first_turns.append(dice.black_starts())
+                rolls.append(dice.roll())
+            return first_turns, rolls
+        dice = DiceStream(7, block_size=4)
+        first_turns, rolls = draw(dice, 3)
+        # Neither the block size nor the first turns drawn change the dice
+        self.assertEqual(draw(DiceStream(7), 3), (first_turns, rolls))
+        more_first_turns, same_rolls = draw(DiceStream(7, block_size=4), 1)
+        self.assertEqual(same_rolls, rolls)
+        self.assertEqual(more_first_turns[:len(first_turns)], first_turns)
+        self.assertEqual(draw(dice.replay(), 3), (first_turns, rolls))
+        other = DiceStream(8, block_size=10)
+        self.assertNotEqual([other.roll() for i in range(25)], rolls)
+
+    def test_rolls(self):
+        dice = DiceStream(0)
+        doubles = 0
+        for i in range(3600):
+            roll = dice.roll()
+            self.assertTrue(all(1 <= die <= 6 for die in roll))
+            if len(roll) == 4:
+                self.assertEqual(len(set(roll)), 1)
+                doubles += 1
+            else:
+                self.assertEqual(len(roll), 2)
+                self.assertNotEqual(roll[0], roll[1])
+        # 600 expected, with a standard deviation of about 22
+        self.assertTrue(500 < doubles < 700)
+
+    def test_spawn(self):
+        dice = DiceStream(3)
+        dice.roll()
+        first = dice.spawn(0)
+        self.assertEqual(first.seed, (3, 0))
+        rolls = [first.roll() for i in range(20)]
+        again = DiceStream(3).spawn(0)
+        self.assertEqual([again.roll() for i in range(20)], rolls)
+        second = dice.spawn(1)
+        self.assertNotEqual([second.roll() for i in range(20)], rolls)
+        self.assertEqual(first.spawn(2).seed, (3, 0, 2))
+
+    def test_pickle(self):
+        dice = DiceStream(5, block_size=4)
+        dice.roll()
+        copy = pickle.loads(pickle.dumps(dice))
+        self.assertEqual([copy.roll() for i in range(10)],
+                         [dice.roll() for i in range(10)])
+
+
+class TestBoardEncoding(unittest.TestCase):
+    def test_round_trip(self):
+        board = get_initial_board()
+        board[BLACK_OFF_INDEX] = (2, 0)
+        board[5] = (3, 0)
+        board[WHITE_BAR_INDEX] = (0, 1)
+        board[0] = (0, 1)
+        data = encode_board(board)
+        self.assertEqual(len(data), 28)
+        self.assertEqual(encode_board(CompactBoard(board)), data)
+        self.assertEqual(decode_board(data), board)
+        self.assertEqual(decode_board(data, compact=True), board)
+        self.assertTrue(isinstance(decode_board(data, True), CompactBoard))
+
+    def test_random_games(self):
+        seen = {}
+        for game in range(5):
+            board = CompactBoard(get_initial_board())
+            is_black_turn = True
+            while not black_wins(board) and not white_wins(board):
+                data = encode_board(board)
+                self.assertEqual(decode_board(data, True), board)
+                self.assertEqual(seen.setdefault(data, board.to_list()),
+                                 board.to_list())
+                board = random.choice(generate_next_boards(
+                        board, is_black_turn, roll_dice()))
+                is_black_turn = not is_black_turn
+
+    def test_canonical_encoding(self):
+        board = get_initial_board()
+        board[5] = (4, 0)
+        board[BLACK_BAR_INDEX] = (1, 0)
+        board = swap_colors(board)
+        self.assertEqual(canonical_encoding(board, True),
+                         canonical_encoding(swap_colors(board), False))
+        self.assertNotEqual(canonical_encoding(board, True),
+                            canonical_encoding(board, False))
+
+
+class TestMoveCache(unittest.TestCase):
+    def setUp(self):
+        clear_move_cache()
+
+    def tearDown(self):
+        set_move_cache_size(DEFAULT_MOVE_CACHE_SIZE)
+
+    def test_hits_and_misses(self):
+        board = get_initial_board()
+        first = generate_next_boards(board, False, [3, 1])
+        self.assertEqual(move_cache_info().misses, 1)
+        # Same roll in the other order and the same position for black
+        second = generate_next_boards(board, False, [1, 3])
+        third = generate_next_boards(swap_colors(board), True, [3, 1])
+        info = move_cache_info()
+        self.assertEqual(info.hits, 2)
+        self.assertEqual(info.misses, 1)
+        self.assertEqual(info.currsize, 1)
+        self.assertEqual(sorted(first), sorted(second))
+        self.assertEqual(sorted(first),
+                         sorted(swap_colors(b) for b in third))
+
+    def test_order_independent_of_cache(self):
+        # Players choose by index, so a cached roll in the other order must
+        # give the same list as a fresh search
+        board = get_initial_board()
+        cached = generate_next_boards(board, False, [3, 1])
+        self.assertEqual(generate_next_boards(board, False, [1, 3]), cached)
+        set_move_cache_size(0)
+        self.assertEqual(generate_next_boards(board, False, [1, 3]), cached)
+        self.assertEqual(generate_next_boards(board, False, [3, 1]), cached)
+
+    def test_returns_fresh_boards(self):
+        board = get_initial_board()
+        first = generate_next_boards(board, False, [6, 5])
+        first[0][0] = (15, 15)
+        second = generate_next_boards(board, False, [6, 5])
+        for next_board in second:
+            self.assertTrue(is_valid_board(next_board))
+
+    def test_eviction(self):
+        set_move_cache_size(2)
+        board = get_initial_board()
+        for roll in [[1, 2], [1, 3], [1, 4]]:
+            generate_next_boards(board, False, roll)
+        self.assertEqual(move_cache_info().currsize, 2)
+        generate_next_boards(board, False, [1, 2])
+        self.assertEqual(move_cache_info().hits, 0)
+        generate_next_boards(board, False, [1, 4])
+        self.assertEqual(move_cache_info().hits, 1)
+
+    def test_search_info(self):
+        clear_search_info()
+        board = get_initial_board()
+        generate_next_boards(board, False, [2, 2, 2, 2])
+        generate_next_boards(board, False, [2, 2, 2, 2])
+        info = search_info()
+        self.assertEqual(info.searches, 1)
+        self.assertTrue(0 < info.nodes_expanded == info.max_nodes_expanded)
+        # Moving the same checkers in a different order is merged: the
+        # unmerged tree expands 122 nodes here
+        self.assertTrue(info.nodes_expanded < 100)
+
+
+class TestBatch(unittest.TestCase):
+    def test_generate_next_boards_batch(self):
+        board = get_initial_board()
+        boards = [board, CompactBoard(board), swap_colors(board)]
+        colors = [False, True, True]
+        rolls = [[3, 1], [6, 6, 6, 6], [3, 1]]
+        successors, offsets = generate_next_boards_batch(boards, colors, rolls)
+        self.assertEqual(successors.shape, (offsets[-1], 56))
+        for i in range(len(boards)):
+            expected = generate_next_boards(boards[i], colors[i], rolls[i])
+            self.assertEqual(unpack_next_boards(successors, offsets, i),
+                             [CompactBoard(b) for b in expected])
+        # Seen from the mover, black's 3-1 looks like white's 3-1
+        successors, offsets = generate_next_boards_batch(
+                boards, colors, rolls, mover_perspective=True)
+        self.assertEqual(set(unpack_next_boards(successors, offsets, 0)),
+                         set(unpack_next_boards(successors, offsets, 2)))
+
+    def test_empty_batch(self):
+        successors, offsets = generate_next_boards_batch([], [], [])
+        self.assertEqual(successors.shape, (0, 56))
+        self.assertEqual(list(offsets), [0])
+
+
+
+class TestBearoff(unittest.TestCase):
+    CHECKERS = 3
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.path = os.path.join(cls.directory, 'bearoff.db')
+        expected_rolls, distributions = generate_database(cls.CHECKERS)
+        save_database(cls.path, expected_rolls, distributions, cls.CHECKERS)
+        cls.database = BearoffDatabase(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def race(self, white, black):
+        """
+        Board with white's and black's home points (1 to 6 pips from off)
+        holding <white> and <black>, the rest of the checkers off.
+        """
+        board = get_blank_board()
+        for pips, count in enumerate(white):
+            board[23 - pips] = (0, count)
+        for pips, count in enumerate(black):
+            board[pips] = (count, 0)
+        board[WHITE_OFF_INDEX] = (0, 15 - sum(white))
+        board[BLACK_OFF_INDEX] = (15 - sum(black), 0)
+        return board
+
+    def test_expected_rolls(self):
+        board = self.race([1, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 3])
+        self.assertTrue(is_bearoff_race(board))
+        self.assertAlmostEqual(self.database.expected_rolls(board, False), 1)
+        # One checker 6 pips out is off in one roll unless the dice move
+        # it less than 6 pips (9 of 36 rolls), then always in the next
+        board = self.race([0, 0, 0, 0, 0, 1], [0, 0, 0, 0, 0, 3])
+        self.assertAlmostEqual(self.database.expected_rolls(board, False),
+                               1 + 9/36.0, places=5)
+        self.assertTrue(self.database.expected_rolls(board, True) > 2)
+
+    def test_win_probability(self):
+        board = self.race([2, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 3])
+        self.assertAlmostEqual(self.database.win_probability(board, False), 1)
+        # Black needs 6-6 to bear off three checkers in one roll
+        self.assertAlmostEqual(self.database.win_probability(board, True),
+                               1/36.0, places=5)
+        board = self.race([0, 0, 0, 0, 0, 1], [0, 0, 0, 0, 0, 1])
+        self.assertAlmostEqual(self.database.win_probability(board, False),
+                               27/36.0 + 9/36.0 * 9/36.0, places=5)
+
+    def test_best_move(self):
+        board = CompactBoard(self.race([0, 0, 0, 0, 0, 2],
+                                       [0, 0, 0, 0, 0, 2]))
+        board_list = generate_next_boards(board, False, [6, 1])
+        best = board_list[self.database.best_move(False, board_list)]
+        # Bear one checker off and move the other to the 5 point
+        self.assertEqual(best, self.race([0, 0, 0, 0, 1, 0],
+                                         [0, 0, 0, 0, 0, 2]))
+
+    def test_not_a_race(self):
+        self.assertFalse(is_bearoff_race(get_initial_board()))
+        board = self.race([0, 0, 0, 0, 0, 4], [0, 0, 0, 0, 0, 1])
+        self.assertRaises(KeyError, self.database.index, board, False)
+
+    def test_pickle(self):
+        database = pickle.loads(pickle.dumps(self.database))
+        self.assertEqual(database.path, self.path)
+        self.assertEqual(database.expected_rolls(self.race([1], [1]), True), 1)
+
+    def test_bad_file(self):
+        path = os.path.join(self.directory, 'bad.db')
+        with open(path, 'wb') as f:
+            f.write(b'not a database at all')
+        self.assertRaises(BearoffError, BearoffDatabase, path)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,4 +1,5 @@
 import random
+from itertools import chain
 
 BLACK_INDEX = 0
 WHITE_INDEX = 1
@@ -28,6 +29,15 @@ def get_initial_board():
     board[23]  = (2, 0)
     return board
 
+def flatten_board(board):
+    """
+    Returns the board as a flat sequence of 56 counts ordered (black, white)
+    point by point, the layout fed to the neural net.
+    """
+    if isinstance(board, CompactBoard):
+        return board.flat
+    return list(chain.from_iterable(board))
+
 def black_wins(board):
     return board[BLACK_OFF_INDEX] == (15, 0)
 
@@ -35,6 +45,8 @@ def white_wins(board):
     return board[WHITE_OFF_INDEX] == (0, 15)
 
 def is_valid_board(board):
+    if isinstance(board, CompactBoard):
+        return board.is_valid()
     assert sum(position[WHITE_INDEX] for position in board) == 15
     assert sum(position[BLACK_INDEX] for position in board) == 15
     assert board[BLACK_BAR_INDEX][WHITE_INDEX] == 0
@@ -95,6 +107,8 @@ def swap_colors(board):
         tmp0, tmp1 = board[i]
         board[i] = (board[j][1], board[j][0])
         board[j] = (tmp1, tmp0)
+    if isinstance(board, CompactBoard):
+        return board.swapped()
     board = board[:]
     _in_place_swap(board, 0, 23)
     _in_place_swap(board, 1, 22)
@@ -112,3 +126,163 @@ def swap_colors(board):
     _in_place_swap(board, BLACK_OFF_INDEX, WHITE_OFF_INDEX)
     return board
 
+
+# Byte translation tables for encode_board / decode_board
+_NEGATE = bytearray((256 - count) % 256 for count in range(256))
+_BLACK_COUNTS = bytearray(256 - code if code >= 128 else 0
+                          for code in range(256))
+_WHITE_COUNTS = bytearray(code if code < 128 else 0 for code in range(256))
+
+def encode_board(board):
+    """
+    Returns the 28 byte string encoding of a valid <board>.  Each byte holds
+    the white count of its point, or the black count negated (mod 256) as a
+    valid board never has both colors on one point.  Encodings hash and
+    compare in O(1) and round trip through decode_board.
+    """
+    if not isinstance(board, CompactBoard):
+        return bytes(bytearray(white or _NEGATE[black]
+                               for black, white in board))
+    flat = board.flat
+    data = flat[WHITE_INDEX::2]
+    for point, count in enumerate(flat[BLACK_INDEX::2].translate(_NEGATE)):
+        if count:
+            data[point] = count
+    return bytes(data)
+
+def decode_board(data, compact=False):
+    """
+    Inverse of encode_board.  Returns a list board, or a CompactBoard if
+    <compact>.
+    """
+    data = bytearray(data)
+    board = CompactBoard.__new__(CompactBoard)
+    board.flat = bytearray(56)
+    board.flat[BLACK_INDEX::2] = data.translate(_BLACK_COUNTS)
+    board.flat[WHITE_INDEX::2] = data.translate(_WHITE_COUNTS)
+    if compact:
+        return board
+    return board.to_list()
+
+def canonical_encoding(board, is_black_turn):
+    """
+    Encodes <board> from the point of view of the player to move, so a
+    position and its color swapped twin (see swap_colors) share one key.
+    """
+    if is_black_turn:
+        board = swap_colors(board)
+    return encode_board(board)
+
+
+class CompactBoard(object):
+    """
+    Compact drop-in replacement for the list of 2-tuples board (see README).
+
+    The 28 (black, white) pairs are stored flattened in a single 56 byte
+    buffer, so copying, swapping colors and hashing are single buffer
+    operations and the network can read the flat layout directly.  Indexing
+    still returns (black, white) tuples so code written against list boards
+    keeps working.  Boards are hashed by value: don't mutate a board after
+    using it as a dict key.
+    """
+    __slots__ = ('flat',)
+
+    def __init__(self, board=None):
+        if board is None:
+            self.flat = bytearray(56)
+        elif isinstance(board, CompactBoard):
+            self.flat = bytearray(board.flat)
+        else:
+            self.flat = bytearray(chain.from_iterable(board))
+        assert len(self.flat) == 56
+
+    @classmethod
+    def from_bytes(cls, data):
+        board = cls.__new__(cls)
+        board.flat = bytearray(data)
+        assert len(board.flat) == 56
+        return board
+
+    def copy(self):
+        board = CompactBoard.__new__(CompactBoard)
+        board.flat = self.flat[:]
+        return board
+
+    def to_list(self):
+        flat = self.flat
+        return [(flat[i], flat[i+1]) for i in range(0, 56, 2)]
+
+    def to_bytes(self):
+        return bytes(self.flat)
+
+    def as_array(self):
+        """
+        Returns a (28, 2) int8 numpy view sharing memory with this board.
+        """
+        import numpy as np
+        return np.frombuffer(self.flat, dtype=np.int8).reshape(28, 2)
+
+    def __getstate__(self):
+        return bytes(self.flat)
+
+    def __setstate__(self, state):
+        self.flat = bytearray(state)
+
+    def __len__(self):
+        return 28
+
+    def __getitem__(self, position):
+        flat = self.flat
+        return (flat[2*position], flat[2*position+1])
+
+    def __setitem__(self, position, counts):
+        self.flat[2*position] = counts[BLACK_INDEX]
+        self.flat[2*position+1] = counts[WHITE_INDEX]
+
+    def __iter__(self):
+        flat = self.flat
+        for i in range(0, 56, 2):
+            yield (flat[i], flat[i+1])
+
+    def __eq__(self, other):
+        if isinstance(other, CompactBoard):
+            return self.flat == other.flat
+        if isinstance(other, list):
+            return self.to_list() == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    def __hash__(self):
+        return hash(bytes(self.flat))
+
+    def __repr__(self):
+        return 'CompactBoard({!r})'.format(self.to_list())
+
+    def is_valid(self):
+        flat = self.flat
+        assert sum(flat[WHITE_INDEX::2]) == 15
+        assert sum(flat[BLACK_INDEX::2]) == 15
+        assert flat[2*BLACK_BAR_INDEX + WHITE_INDEX] == 0
+        assert flat[2*WHITE_BAR_INDEX + BLACK_INDEX] == 0
+        assert flat[2*BLACK_OFF_INDEX + WHITE_INDEX] == 0
+        assert flat[2*WHITE_OFF_INDEX + BLACK_INDEX] == 0
+        for i in range(0, 56, 2):
+            if flat[i] > 0 and flat[i+1] > 0:
+                return False
+        return True
+
+    def swapped(self):
+        """
+        Color swapped copy (see swap_colors).  Reversing the flattened points
+        mirrors the board and swaps each (black, white) pair in one go; the
+        bar and off pairs are reversed the same way.
+        """
+        flat = self.flat
+        board = CompactBoard.__new__(CompactBoard)
+        board.flat = flat[47::-1] + flat[51:47:-1] + flat[55:51:-1]
+        return board
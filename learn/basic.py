@@ -1,3 +1,8 @@
+import copy
+
+from backgammon.utility import swap_colors
+
+
 class BasePlayer(object):
     def move(self, is_black_turn, roll, current_board, board_list):
         raise NotImplementedError('move() not implemented')
@@ -5,12 +10,26 @@ class BasePlayer(object):
     def learn(self):
         raise NotImplementedError('learn() not implemented')
 
+    def flush_training(self):
+        '''
+        Learns from anything held back for a later update (see
+        NeuralNetMover's games_per_update).  Nothing by default.
+        '''
+        pass
+
     def save_state(self, path):
         raise NotImplementedError('save_state() not implemented')
 
     def load_state(self, path):
         raise NotImplementedError('load_state() not implemented')
 
+    def snapshot(self):
+        '''
+        Returns a copy whose save_state() saves the current state, even if
+        this player keeps changing.
+        '''
+        return copy.deepcopy(self)
+
 
 class BaseMoveTracker(object):
     def reset_move_tracking(self):
@@ -29,6 +48,16 @@ class BaseMoveTracker(object):
         self.black_payoff = 1 if black_won else -1
         self.white_payoff = 1 if not black_won else -1
 
+    def training_pairs(self):
+        '''
+        Returns a (board, payoff) pair for every tracked move, with the
+        board seen from the player who moved (black's boards color swapped).
+        '''
+        training = [(swap_colors(board), self.black_payoff)
+                    for board in self.black_moves]
+        training += [(board, self.white_payoff) for board in self.white_moves]
+        return training
+
     def assert_moves_were_tracked(self):
         assert len(self.black_moves) > 0
         assert len(self.white_moves) > 0
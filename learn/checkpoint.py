@@ -0,0 +1,126 @@
+'''
+Versioned binary checkpoints for NeuralNetMover weights.
+
+Layout (little endian):
+
+    * 32 byte header: magic 'GGNN', format version, bytes per weight (4 or
+      8), hidden neurons and inputs, zero padded
+    * input_to_hidden_weights (hidden x inputs), input_to_hidden_biases
+      (hidden), hidden_to_output_weights (hidden) and hidden_to_output_bias
+      (1) as raw floats, back to back
+
+Loading memory-maps the file copy-on-write, so the weights are read
+straight from the page cache and can still be trained in memory.  Old
+pickled states are detected and loaded transparently.
+
+Usage: python -m learn.checkpoint path/to/state.pkl [...]
+converts pickled states into checkpoints next to them.
+'''
+import os
+import sys
+import pickle
+import struct
+
+import numpy as np
+
+MAGIC = b'GGNN'
+VERSION = 1
+HEADER = struct.Struct('<4sIIII')
+HEADER_SIZE = 32
+DTYPES = {4: np.dtype('<f4'), 8: np.dtype('<f8')}
+CHECKPOINT_EXTENSION = '.ckpt'
+
+
+class CheckpointError(Exception):
+    pass
+
+
+def save_checkpoint(path, weights, dtype=np.float64):
+    '''
+    Writes <weights> (input_to_hidden_weights, input_to_hidden_biases,
+    hidden_to_output_weights, hidden_to_output_bias) to <path>.
+
+    The weights are written to a temporary file that is then renamed over
+    <path>: weights loaded from <path> are still mapped from it, and
+    truncating the file under them would crash with SIGBUS.
+    '''
+    dtype = np.dtype(dtype).newbyteorder('<')
+    input_to_hidden_weights = np.asarray(weights[0])
+    hidden, inputs = input_to_hidden_weights.shape
+    header = HEADER.pack(MAGIC, VERSION, dtype.itemsize, hidden, inputs)
+    temp_path = '{}.tmp'.format(path)
+    with open(temp_path, 'wb') as f:
+        f.write(header.ljust(HEADER_SIZE, b'\0'))
+        for array in weights:
+            f.write(np.asarray(array, dtype=dtype).tobytes())
+    os.rename(temp_path, path)
+
+def is_checkpoint(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def load_checkpoint(path):
+    '''
+    Memory-maps the checkpoint at <path> and returns the weights as views
+    into it, in the order save_checkpoint takes them.
+    '''
+    with open(path, 'rb') as f:
+        header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise CheckpointError('{} is truncated'.format(path))
+    magic, version, itemsize, hidden, inputs = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise CheckpointError('{} is not a checkpoint'.format(path))
+    if version != VERSION:
+        raise CheckpointError('{} has unsupported version {}'.format(
+                path, version))
+    if itemsize not in DTYPES:
+        raise CheckpointError('{} has unsupported weight size {}'.format(
+                path, itemsize))
+    count = hidden*inputs + 2*hidden + 1
+    if os.path.getsize(path) != HEADER_SIZE + count*itemsize:
+        raise CheckpointError('{} has the wrong size'.format(path))
+    flat = np.memmap(path, dtype=DTYPES[itemsize], mode='c',
+                     offset=HEADER_SIZE, shape=(count,))
+    end = hidden*inputs
+    input_to_hidden_weights = flat[:end].reshape(hidden, inputs)
+    input_to_hidden_biases = flat[end:end+hidden]
+    hidden_to_output_weights = flat[end+hidden:end+2*hidden]
+    hidden_to_output_bias = float(flat[end+2*hidden])
+    return (input_to_hidden_weights, input_to_hidden_biases,
+            hidden_to_output_weights, hidden_to_output_bias)
+
+def load_pickle(path):
+    '''
+    Loads a state pickled by older versions of NeuralNetMover.save_state
+    (plain lists, hidden neuron index -> input weights).
+    '''
+    with open(path, 'rb') as f:
+        serialized_self = pickle.load(f)
+    input_to_hidden_weights = serialized_self[0]
+    input_to_hidden_weights = np.array(
+            [input_to_hidden_weights[neuron_index]
+             for neuron_index in range(len(input_to_hidden_weights))])
+    return (input_to_hidden_weights,
+            np.array(serialized_self[1]),
+            np.array(serialized_self[2]),
+            float(serialized_self[3]))
+
+def load_weights(path):
+    if is_checkpoint(path):
+        return load_checkpoint(path)
+    return load_pickle(path)
+
+def convert_pickle(path):
+    '''
+    Writes the pickled state at <path> as a checkpoint next to it and
+    returns the checkpoint's path.
+    '''
+    checkpoint_path = os.path.splitext(path)[0] + CHECKPOINT_EXTENSION
+    save_checkpoint(checkpoint_path, load_pickle(path))
+    return checkpoint_path
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        print '{} -> {}'.format(path, convert_pickle(path))
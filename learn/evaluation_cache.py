@@ -0,0 +1,84 @@
+'''
+Bounded cache of NeuralNetMover outputs, so positions that come up again
+across turns and games (openings, bear-offs) skip the forward pass.
+'''
+from collections import namedtuple
+
+import numpy as np
+
+from backgammon.utility import encode_board
+
+DEFAULT_EVALUATION_CACHE_SIZE = 200000
+
+EvaluationCacheInfo = namedtuple('EvaluationCacheInfo',
+                                 ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+def hit_rate(info):
+    lookups = info.hits + info.misses
+    return float(info.hits) / lookups if lookups else 0.0
+
+
+class EvaluationCache(object):
+    '''
+    Maps boards (as seen by the mover) to network outputs for one version
+    of the weights.  Boards are keyed on encode_board, so list and compact
+    copies of a position share an entry.  Evaluating under a new version
+    drops every entry.
+
+    Eviction is least recently used by generation: entries live in a recent
+    and an old dict, a hit in the old dict moves the entry back to the
+    recent one, and once the recent dict holds half of <maxsize> entries
+    the old one is dropped.  Lookups stay at plain dict speed; an
+    OrderedDict per board costs about as much as the forward pass saved.
+    '''
+    def __init__(self, maxsize=DEFAULT_EVALUATION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.clear()
+
+    def clear(self):
+        self.hits = 0
+        self.misses = 0
+        self.version = None
+        self._recent = {}
+        self._old = {}
+
+    def evaluate(self, board_list, version, evaluate_boards):
+        '''
+        Returns the outputs for <board_list> under weights <version>,
+        calling <evaluate_boards> once on the boards not cached.
+        '''
+        if version != self.version:
+            self._recent = {}
+            self._old = {}
+            self.version = version
+        keys = [encode_board(board) for board in board_list]
+        outputs = np.empty(len(keys))
+        recent = self._recent
+        old = self._old
+        missing = []
+        for index, key in enumerate(keys):
+            output = recent.get(key)
+            if output is None:
+                output = old.pop(key, None)
+                if output is None:
+                    missing.append(index)
+                    continue
+                recent[key] = output
+            outputs[index] = output
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            missing_outputs = evaluate_boards([board_list[index]
+                                               for index in missing])
+            for index, output in zip(missing, missing_outputs):
+                outputs[index] = output
+                recent[keys[index]] = float(output)
+            if len(recent) >= self.maxsize // 2:
+                self._old = recent
+                self._recent = {}
+        return outputs
+
+    def info(self):
+        return EvaluationCacheInfo(self.hits, self.misses, self.maxsize,
+                                   len(self._recent) + len(self._old))
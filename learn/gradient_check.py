@@ -0,0 +1,63 @@
+'''
+Checks NeuralNetMover's analytic gradients against numerical gradients on
+random boards.
+
+Usage: python -m learn.gradient_check [boards]
+'''
+import random
+import sys
+
+import numpy as np
+
+from learn.neural_net import NeuralNetMover, boards_to_inputs
+from backgammon.boards import generate_next_boards
+from backgammon.utility import (get_initial_board, roll_dice, black_wins,
+                                white_wins, CompactBoard)
+
+GRADIENT_NAMES = ['input_to_hidden_weights', 'input_to_hidden_biases',
+                  'hidden_to_output_weights', 'hidden_to_output_bias']
+
+
+def random_boards(count, max_turns=60):
+    '''
+    Returns <count> boards reached by playing random moves from the
+    initial board.
+    '''
+    boards = []
+    while len(boards) < count:
+        board = CompactBoard(get_initial_board())
+        is_black_turn = random.choice([True, False])
+        for turn in range(random.randint(0, max_turns)):
+            board = random.choice(
+                    generate_next_boards(board, is_black_turn, roll_dice()))
+            is_black_turn = not is_black_turn
+            if black_wins(board) or white_wins(board):
+                break
+        boards.append(board)
+    return boards
+
+def check_gradients(net, boards):
+    '''
+    Returns the largest relative error between the analytic and numerical
+    gradients of the output for each of <boards>, per gradient name.
+    '''
+    max_errors = dict((name, 0.0) for name in GRADIENT_NAMES)
+    for board in boards:
+        inputs = boards_to_inputs([board])
+        analytic = net.gradients(inputs, np.ones(1))
+        numerical = net.numerical_gradients(board)
+        for name, a, n in zip(GRADIENT_NAMES, analytic, numerical):
+            a = np.asarray(a)
+            n = np.asarray(n)
+            scale = np.maximum(np.abs(a) + np.abs(n), 1e-8)
+            error = float(np.max(np.abs(a - n) / scale))
+            max_errors[name] = max(max_errors[name], error)
+    return max_errors
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    max_errors = check_gradients(NeuralNetMover(), random_boards(count))
+    print 'Max relative gradient error over {} random boards:'.format(count)
+    for name in GRADIENT_NAMES:
+        print '    {0}: {1:.2e}'.format(name, max_errors[name])
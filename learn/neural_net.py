@@ -2,13 +2,17 @@
 Extremely basic implementation of a neural network.  Inefficient and naive
 but will provide a template for future work.
 '''
+import copy
 import math
 import random
-import pickle
-from itertools import chain
+
+import numpy as np
 
 from learn.basic import BaseMoveTracker, BasePlayer
-from backgammon.utility import swap_colors
+from learn.checkpoint import save_checkpoint, load_weights
+from learn.evaluation_cache import EvaluationCache
+from backgammon.bearoff import is_bearoff_race
+from backgammon.utility import swap_colors, flatten_board
 
 
 '''
@@ -28,6 +32,17 @@ Questions:
     * How do we determine a good shape for the network?
 '''
 
+def boards_to_inputs(board_list):
+    '''
+    Stacks the flattened boards into a (k, 56) float matrix of net inputs.
+    '''
+    flat = bytearray()
+    for board in board_list:
+        flat.extend(flatten_board(board))
+    inputs = np.frombuffer(flat, dtype=np.int8).reshape(-1, 56)
+    return inputs.astype(np.float64)
+
+
 class NeuralNetMover(BaseMoveTracker, BasePlayer):
     '''
     Fully connected with one hidden layer.
@@ -47,11 +62,12 @@ class NeuralNetMover(BaseMoveTracker, BasePlayer):
         * For each board along the losing rollout, we train the network to
           respond with weaker activation.
 
-    Uses numerical gradients which will be inefficient but (hopefully)
-    explicit.
+    Weights are numpy arrays and move() scores every candidate board in
+    one matrix product.  Gradients are computed analytically by
+    backpropagation; numerical_gradients() is kept to check them (see
+    learn/gradient_check.py).
 
     TODO:
-        * Analytic gradients
         * Use a cross-entropy function for cost; choose the highest cost board
           (or still use roulette select?)
         * Regularize cost function
@@ -59,74 +75,126 @@ class NeuralNetMover(BaseMoveTracker, BasePlayer):
           boards push activation toward 1
         * Play against neural network opponent to learn against stronger
           strategies
-        * Numpy for efficiency, then keras and/or tensorflow
+        * Keras and/or tensorflow
         * Smarter weight initialization
         * Batch training vs online training?
         * Other hyper parameter tuning (regularization constant, learning rate)
         * Different network architectures
         * Optimize backgammon board generation
     '''
-    def __init__(self):
+    def __init__(self, step_size=.01, games_per_update=None, batch_size=None,
+                 evaluation_cache_size=None, bearoff_database=None):
+        '''
+        By default the weights are updated board by board after each game.
+        With <games_per_update>, the boards of that many games are
+        collected and trained on in mini-batches of <batch_size> boards (all
+        of them if None), one summed gradient update per mini-batch.
+
+        With <evaluation_cache_size>, board outputs are cached (see
+        learn/evaluation_cache.py) until the weights next change.
+
+        With <bearoff_database> (see backgammon/bearoff.py), races in which
+        both sides are bearing off are played from its exact values instead
+        of the net.
+        '''
         self.reset_move_tracking()
         self.FLAT_BOARD_SIZE = 56
         self.HIDDEN_LAYER_NEURONS = 56
+        self.STEP_SIZE = step_size
+        self.GAMES_PER_UPDATE = games_per_update
+        self.BATCH_SIZE = batch_size
+        self.pending_training = []
+        self.pending_games = 0
+        self.evaluation_cache = None
+        if evaluation_cache_size:
+            self.evaluation_cache = EvaluationCache(evaluation_cache_size)
+        self.weights_version = 0
+        self.bearoff_database = bearoff_database
         self.initialize_weights()
 
     def initialize_weights(self):
-        small_random = lambda: (random.random() - .5)*.01
-        small_random_list = lambda x: [small_random() for i in range(x)]
-        self.input_to_hidden_weights = {}
-        self.input_to_hidden_biases = [0]*self.HIDDEN_LAYER_NEURONS
-        for neuron_index in range(self.HIDDEN_LAYER_NEURONS):
-            input_weights = small_random_list(self.FLAT_BOARD_SIZE)
-            self.input_to_hidden_weights[neuron_index] = input_weights
-            self.input_to_hidden_biases[neuron_index] = small_random()
-        output_weights = small_random_list(self.HIDDEN_LAYER_NEURONS)
-        self.hidden_to_output_weights = output_weights
-        self.hidden_to_output_bias = small_random()
+        self.weights_version += 1
+        small_random = lambda *shape: (np.random.random(shape) - .5)*.01
+        # Row i holds the input weights of hidden neuron i
+        self.input_to_hidden_weights = small_random(self.HIDDEN_LAYER_NEURONS,
+                                                    self.FLAT_BOARD_SIZE)
+        self.input_to_hidden_biases = small_random(self.HIDDEN_LAYER_NEURONS)
+        self.hidden_to_output_weights = small_random(self.HIDDEN_LAYER_NEURONS)
+        self.hidden_to_output_bias = float(small_random(1)[0])
 
     def move(self, is_black_turn, roll, current_board, board_list):
+        if self.plays_bearoff(current_board):
+            return self.bearoff_database.best_move(is_black_turn, board_list)
         if is_black_turn:
             board_list = [swap_colors(board) for board in board_list]
-        outputs = [self.feed_forward(board) for board in board_list]
+        outputs = self.feed_forward_boards(board_list)
         return self.softmax_choose(outputs)
 
+    def plays_bearoff(self, board):
+        return (self.bearoff_database is not None and board is not None and
+                is_bearoff_race(board))
+
     def feed_forward(self, board):
-        hidden_activations = self.feed_to_hidden_layer(board)
-        return self.feed_to_output(hidden_activations)
+        return self.feed_forward_boards([board])[0]
+
+    def feed_forward_boards(self, board_list):
+        if self.evaluation_cache is not None:
+            return self.evaluation_cache.evaluate(
+                    board_list, self.weights_version, self._evaluate_boards)
+        return self._evaluate_boards(board_list)
+
+    def _evaluate_boards(self, board_list):
+        return self.feed_forward_inputs(boards_to_inputs(board_list))
+
+    def feed_forward_inputs(self, inputs):
+        '''
+        Scores every row of the (k, 56) <inputs> matrix in one pass.
+        '''
+        hidden_activations = self.sigmoid(
+                inputs.dot(self.input_to_hidden_weights.T) +
+                self.input_to_hidden_biases)
+        return self.sigmoid(
+                hidden_activations.dot(self.hidden_to_output_weights) +
+                self.hidden_to_output_bias)
 
     @classmethod
     def sigmoid(cls, val):
-        return 1.0 / (1 + math.exp(-1* val))
+        return 1.0 / (1 + np.exp(-1* val))
 
     def feed_to_hidden_layer(self, board):
-        sigmoid_activations = {}
-        for neuron_index in range(self.HIDDEN_LAYER_NEURONS):
-            activation = self.feed_to_hidden_neuron(neuron_index, board)
-            sigmoid_activations[neuron_index] = activation
-        return sigmoid_activations
+        flat_board = boards_to_inputs([board])[0]
+        return self.sigmoid(self.input_to_hidden_weights.dot(flat_board) +
+                            self.input_to_hidden_biases)
 
     def feed_to_hidden_neuron(self, neuron_index, board):
-        flat_board = list(chain.from_iterable(board))
-        assert len(flat_board) == 56
+        flat_board = boards_to_inputs([board])[0]
         neuron_weights = self.input_to_hidden_weights[neuron_index]
         assert len(neuron_weights) == len(flat_board)
-        activation = 0.0
-        for i in range(len(flat_board)):
-            activation += neuron_weights[i]*flat_board[i]
+        activation = neuron_weights.dot(flat_board)
         activation += self.input_to_hidden_biases[neuron_index]
         return self.sigmoid(activation)
 
     def feed_to_output(self, hidden_activations):
         assert len(hidden_activations) == len(self.hidden_to_output_weights)
-        activation = 0.0
-        for neuron_index in range(self.HIDDEN_LAYER_NEURONS):
-            hidden_activation = hidden_activations[neuron_index]
-            weight = self.hidden_to_output_weights[neuron_index]
-            activation += hidden_activation*weight
+        activation = np.dot(hidden_activations, self.hidden_to_output_weights)
         activation += self.hidden_to_output_bias
         return self.sigmoid(activation)
 
+    def choose_moves(self, outputs, offsets, rng=np.random):
+        '''
+        Bulk version of softmax_choose for the scores of several games.
+        The candidates of game i are outputs[offsets[i]:offsets[i+1]];
+        returns the chosen index within each game's candidates.
+        '''
+        starts = offsets[:-1]
+        exp_outputs = np.exp(outputs)
+        cumulative = np.cumsum(exp_outputs)
+        before = np.concatenate(([0.0], cumulative))[starts]
+        totals = np.add.reduceat(exp_outputs, starts)
+        thresholds = before + rng.random_sample(len(starts)) * totals
+        choices = np.searchsorted(cumulative, thresholds, side='right')
+        return np.minimum(choices, offsets[1:] - 1) - starts
+
     def softmax_choose(self, outputs):
         exp_outputs = [math.exp(output) for output in outputs]
         sum_exp_outputs = sum(exp_outputs)
@@ -148,155 +216,200 @@ class NeuralNetMover(BaseMoveTracker, BasePlayer):
     def learn(self):
         self.assert_moves_were_tracked()
         training = self.apply_policy_gradients()
-        self.stochastic_gradient_descent(training)
+        if self.GAMES_PER_UPDATE is None:
+            self.stochastic_gradient_descent(training)
+        else:
+            self.pending_training += training
+            self.pending_games += 1
+            if self.pending_games >= self.GAMES_PER_UPDATE:
+                self.flush_training()
         self.reset_move_tracking()
 
+    def flush_training(self):
+        '''
+        Trains on the boards collected since the last batched update.
+        '''
+        self.batch_gradient_descent(self.pending_training)
+        self.pending_training = []
+        self.pending_games = 0
+
     def apply_policy_gradients(self):
-        training = []
-        self.black_moves = [swap_colors(board) for board in self.black_moves]
-        training = [(board, self.black_payoff) for board in self.black_moves]
-        training += [(board, self.white_payoff) for board in self.white_moves]
-        return training
+        return self.training_pairs()
 
     def stochastic_gradient_descent(self, training):
         for (board, payoff) in training:
             self.backpropagate(board, payoff)
 
+    def batch_gradient_descent(self, training):
+        '''
+        Applies one update per mini-batch of BATCH_SIZE (board, payoff)
+        pairs.  Gradients are summed, not averaged, so a batch takes roughly
+        the step the same boards would take one at a time.
+        '''
+        if not training:
+            return
+        inputs = boards_to_inputs([board for (board, payoff) in training])
+        payoffs = np.array([payoff for (board, payoff) in training],
+                           dtype=float)
+        batch_size = self.BATCH_SIZE or len(training)
+        for start in range(0, len(training), batch_size):
+            end = start + batch_size
+            gradients = self.gradients(inputs[start:end], payoffs[start:end])
+            self.apply_gradients(gradients, self.STEP_SIZE)
+
     def backpropagate(self, board, payoff):
         '''
-        Calculate gradients numerically.
+        Moves the weights along the gradient of the output for <board> in the
+        direction of the <payoff>.
         '''
-        output_old = self.feed_forward(board)
-        self.backpropagate_to_hidden_layer(board, payoff)
-        self.backpropagate_to_input(board, payoff)
-        output_new = self.feed_forward(board)
+        inputs = boards_to_inputs([board])
+        output_old = self.feed_forward_inputs(inputs)[0]
+        gradients = self.gradients(inputs, np.array([payoff], dtype=float))
+        self.apply_gradients(gradients, self.STEP_SIZE)
+        output_new = self.feed_forward_inputs(inputs)[0]
         if payoff > 0 and output_new < output_old:
             print 'Warning id:1'
         elif payoff < 0 and output_new > output_old:
             print 'Warning id:2'
 
-    def backpropagate_to_hidden_layer(self, board, payoff):
-        # Initialize
-        self.hidden_to_output_weight_gradients = [0.0]
-        self.hidden_to_output_weight_gradients *= self.HIDDEN_LAYER_NEURONS
-        self.hidden_to_output_bias_gradient = 0.0
-
-        # Get hidden activations and current output
-        hidden_activations = self.feed_to_hidden_layer(board)
-        output = self.feed_to_output(hidden_activations)
-
-        # Numerically calculate the gradient for each weight wrt output
-        h = .0001
-        for neuron_index in range(self.HIDDEN_LAYER_NEURONS):
-            self.hidden_to_output_weights[neuron_index] += h
-            output_tweaked = self.feed_to_output(hidden_activations)
-            self.hidden_to_output_weights[neuron_index] -= h
-
-            gradient = (output_tweaked - output)/h
-            self.hidden_to_output_weight_gradients[neuron_index] = gradient
-
-        # Numerically calculate the gradient for the bias wrt output
-        self.hidden_to_output_bias += h
-        output_tweaked = self.feed_to_output(hidden_activations)
-        self.hidden_to_output_bias -= h
-        self.hidden_to_output_bias_gradient = (output_tweaked - output)/h
-
-        # Update weights along gradient in direction of the payoff
-        step_size = .01
-        for neuron_index in range(self.HIDDEN_LAYER_NEURONS):
-            weight = self.hidden_to_output_weights[neuron_index]
-            gradient = self.hidden_to_output_weight_gradients[neuron_index]
-            weight += step_size * gradient * payoff
-            self.hidden_to_output_weights[neuron_index] = weight
-
-        # Update bias along gradient in direction of the payoff
+    def gradients(self, inputs, coefficients):
+        '''
+        Analytic gradients of sum(coefficients[i] * output(inputs[i])) over
+        the rows of the (k, 56) <inputs> matrix, as a tuple of
+        (input_to_hidden_weights, input_to_hidden_biases,
+        hidden_to_output_weights, hidden_to_output_bias) gradients.
+        '''
+        # Forward pass
+        hidden_activations = self.sigmoid(
+                inputs.dot(self.input_to_hidden_weights.T) +
+                self.input_to_hidden_biases)
+        outputs = self.sigmoid(
+                hidden_activations.dot(self.hidden_to_output_weights) +
+                self.hidden_to_output_bias)
+
+        # Backward pass
+        output_gradients = outputs * (1 - outputs) * coefficients
+        hidden_to_output_weight_gradients = \
+                hidden_activations.T.dot(output_gradients)
+        hidden_to_output_bias_gradient = output_gradients.sum()
+        hidden_gradients = (np.outer(output_gradients,
+                                     self.hidden_to_output_weights) *
+                            hidden_activations * (1 - hidden_activations))
+        input_to_hidden_weight_gradients = hidden_gradients.T.dot(inputs)
+        input_to_hidden_bias_gradients = hidden_gradients.sum(axis=0)
+        return (input_to_hidden_weight_gradients,
+                input_to_hidden_bias_gradients,
+                hidden_to_output_weight_gradients,
+                hidden_to_output_bias_gradient)
+
+    def apply_gradients(self, gradients, step_size):
+        self.weights_version += 1
+        self.input_to_hidden_weights += step_size * gradients[0]
+        self.input_to_hidden_biases += step_size * gradients[1]
+        self.hidden_to_output_weights += step_size * gradients[2]
+        self.hidden_to_output_bias += step_size * gradients[3]
+
+    def numerical_gradients(self, board, h=.00001):
+        '''
+        Gradients of the output for <board> by central differences, in the
+        same layout as gradients().  Slow; meant for checking gradients().
+        '''
+        inputs = boards_to_inputs([board])
+        def _numerical_gradient(weights):
+            gradient = np.zeros(weights.shape)
+            for index in np.ndindex(*weights.shape):
+                weight = weights[index]
+                weights[index] = weight + h
+                output_up = self.feed_forward_inputs(inputs)[0]
+                weights[index] = weight - h
+                output_down = self.feed_forward_inputs(inputs)[0]
+                weights[index] = weight
+                gradient[index] = (output_up - output_down)/(2*h)
+            return gradient
+
         bias = self.hidden_to_output_bias
-        bias += step_size * self.hidden_to_output_bias_gradient
+        self.hidden_to_output_bias = bias + h
+        output_up = self.feed_forward_inputs(inputs)[0]
+        self.hidden_to_output_bias = bias - h
+        output_down = self.feed_forward_inputs(inputs)[0]
         self.hidden_to_output_bias = bias
-
-        output_new = self.feed_to_output(hidden_activations)
-        if payoff > 0 and output_new < output:
-            print 'Warning id:3'
-        elif payoff < 0 and output_new > output:
-            print 'Warning id:4'
-
-    def backpropagate_to_input(self, board, payoff):
-        # Initialize
-        self.input_to_hidden_weight_gradients = {}
-        for neuron_index in range(self.HIDDEN_LAYER_NEURONS):
-            gradients = [0.0] * self.FLAT_BOARD_SIZE
-            self.input_to_hidden_weight_gradients[neuron_index] = gradients
-        self.input_to_hidden_bias_gradients = [0.0]*self.HIDDEN_LAYER_NEURONS
-
-        # Numerically calculate gradients for hidden layer weights and biases
-        # wrt to the hidden layer neuron's output
-        h = .0001
-        for neuron_index in range(self.HIDDEN_LAYER_NEURONS):
-            output = self.feed_to_hidden_neuron(neuron_index, board)
-            for input_index in range(self.FLAT_BOARD_SIZE):
-                self.input_to_hidden_weights[neuron_index][input_index] += h
-                output_new = self.feed_to_hidden_neuron(neuron_index, board)
-                self.input_to_hidden_weights[neuron_index][input_index] -= h
-                gradient = (output_new - output)/h
-                self.input_to_hidden_weight_gradients[neuron_index][input_index] = gradient
-            self.input_to_hidden_biases[neuron_index] += h
-            output_new = self.feed_to_hidden_neuron(neuron_index, board)
-            self.input_to_hidden_biases[neuron_index] -= h
-            gradient = (output_new - output)/h
-            self.input_to_hidden_bias_gradients[neuron_index] = gradient
-
-        # Apply chain rule to gradients to update weights and biases
-        step_size = .01
-        for neuron_index in range(self.HIDDEN_LAYER_NEURONS):
-            output_old = self.feed_to_hidden_neuron(neuron_index, board)
-            chain_gradient = self.hidden_to_output_weight_gradients[neuron_index]
-            for input_index in range(self.FLAT_BOARD_SIZE):
-                weight = self.input_to_hidden_weights[neuron_index][input_index]
-                local_gradient = self.input_to_hidden_weight_gradients[neuron_index][input_index]
-                weight += local_gradient * chain_gradient * step_size * payoff
-                self.input_to_hidden_weights[neuron_index][input_index] = weight
-
-            bias = self.input_to_hidden_biases[neuron_index]
-            local_gradient = self.input_to_hidden_bias_gradients[neuron_index]
-            bias += local_gradient * chain_gradient * step_size * payoff
-            self.input_to_hidden_biases[neuron_index] = bias
-            output_new = self.feed_to_hidden_neuron(neuron_index, board)
-            if payoff > 0 and output_new < output_old:
-                print 'Warning id:5'
-            elif payoff < 0 and output_new > output_old:
-                print 'Warning id:6'
+        return (_numerical_gradient(self.input_to_hidden_weights),
+                _numerical_gradient(self.input_to_hidden_biases),
+                _numerical_gradient(self.hidden_to_output_weights),
+                (output_up - output_down)/(2*h))
+
+    def weights(self):
+        return (self.input_to_hidden_weights,
+                self.input_to_hidden_biases,
+                self.hidden_to_output_weights,
+                self.hidden_to_output_bias)
+
+    def set_weights(self, weights):
+        self.weights_version += 1
+        self.input_to_hidden_weights = weights[0]
+        self.input_to_hidden_biases = weights[1]
+        self.hidden_to_output_weights = weights[2]
+        self.hidden_to_output_bias = float(weights[3])
+
+    def snapshot(self):
+        snapshot = copy.copy(self)
+        snapshot.reset_move_tracking()
+        snapshot.pending_training = []
+        snapshot.pending_games = 0
+        if self.evaluation_cache is not None:
+            snapshot.evaluation_cache = EvaluationCache(
+                    self.evaluation_cache.maxsize)
+        snapshot.set_weights([np.array(weights) for weights in self.weights()])
+        return snapshot
 
     def save_state(self, path):
-        serialized_self = [self.input_to_hidden_weights,
-                           self.input_to_hidden_biases,
-                           self.hidden_to_output_weights,
-                           self.hidden_to_output_bias]
-        with open(path, 'wb') as f:
-            pickle.dump(serialized_self, f)
+        save_checkpoint(path, self.weights())
 
     def load_state(self, path):
-        with open(path, 'rb') as f:
-            serialized_self = pickle.load(f)
-        self.input_to_hidden_weights = serialized_self[0]
-        self.input_to_hidden_biases = serialized_self[1]
-        self.hidden_to_output_weights = serialized_self[2]
-        self.hidden_to_output_bias = serialized_self[3]
+        '''
+        Loads a binary checkpoint (memory-mapped) or an old pickled state.
+        '''
+        self.set_weights(load_weights(path))
+
+    def evaluation_cache_info(self):
+        if self.evaluation_cache is None:
+            return None
+        return self.evaluation_cache.info()
 
 
 class DumbNeuralNetMover(NeuralNetMover):
-    '''Simply applies the neural net but doesn't try to learn'''
-    def __init__(self):
-        super(DumbNeuralNetMover, self).__init__()
+    '''
+    Simply applies the neural net but doesn't try to learn.  Its weights
+    only change on load_state, so an evaluation cache is never invalidated
+    mid-evaluation.
+    '''
+    def __init__(self, evaluation_cache_size=None, bearoff_database=None):
+        super(DumbNeuralNetMover, self).__init__(
+                evaluation_cache_size=evaluation_cache_size,
+                bearoff_database=bearoff_database)
 
     def learn(self):
         self.assert_moves_were_tracked()
         self.reset_move_tracking()
 
     def move(self, is_black_turn, roll, current_board, board_list):
+        if self.plays_bearoff(current_board):
+            return self.bearoff_database.best_move(is_black_turn, board_list)
         if is_black_turn:
             board_list = [swap_colors(board) for board in board_list]
-        outputs = [self.feed_forward(board) for board in board_list]
-        return max(enumerate(outputs), key=lambda x: x[1])[0]
+        outputs = self.feed_forward_boards(board_list)
+        return int(np.argmax(outputs))
+
+    def choose_moves(self, outputs, offsets, rng=np.random):
+        '''
+        Bulk version of move(): the first best scoring candidate per game.
+        '''
+        starts = offsets[:-1]
+        maxima = np.maximum.reduceat(outputs, starts)
+        games = np.repeat(np.arange(len(starts)), np.diff(offsets))
+        best = np.flatnonzero(outputs == maxima[games])
+        first_best = np.unique(games[best], return_index=True)[1]
+        return best[first_best] - starts
 
     def save_state(self, path):
         pass
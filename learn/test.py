@@ -0,0 +1,349 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from learn.neural_net import (NeuralNetMover, DumbNeuralNetMover,
+                              boards_to_inputs)
+from learn.evaluation_cache import EvaluationCache
+from learn.gradient_check import (check_gradients, random_boards,
+                                  GRADIENT_NAMES)
+from learn.trajectories import (TrajectoryWriter, ReplayBuffer,
+                                read_trajectories, TrajectoryError)
+from learn.checkpoint import (save_checkpoint, load_checkpoint, is_checkpoint,
+                              convert_pickle, CheckpointError)
+from backgammon.bearoff import (generate_database, save_database,
+                                BearoffDatabase)
+from backgammon.boards import generate_next_boards
+from backgammon.utility import (get_initial_board, get_blank_board,
+                                swap_colors, CompactBoard, WHITE_OFF_INDEX,
+                                BLACK_OFF_INDEX)
+
+
+class TestNeuralNetMover(unittest.TestCase):
+    def setUp(self):
+        self.net = NeuralNetMover()
+        board = CompactBoard(get_initial_board())
+        self.boards = generate_next_boards(board, False, [6, 6, 6, 6])
+
+    def test_feed_forward_boards(self):
+        outputs = self.net.feed_forward_boards(self.boards)
+        self.assertEqual(outputs.shape, (len(self.boards),))
+        for board, output in zip(self.boards, outputs):
+            hidden_activations = self.net.feed_to_hidden_layer(board)
+            expected = self.net.feed_to_output(hidden_activations)
+            self.assertAlmostEqual(output, expected)
+            self.assertAlmostEqual(output,
+                                   self.net.feed_forward(board.to_list()))
+
+    def test_dumb_move(self):
+        net = DumbNeuralNetMover()
+        outputs = net.feed_forward_boards(self.boards)
+        index = net.move(False, [6, 6, 6, 6], None, self.boards)
+        self.assertEqual(index, np.argmax(outputs))
+        black_boards = [swap_colors(board) for board in self.boards]
+        self.assertEqual(net.move(True, [6, 6, 6, 6], None, black_boards),
+                         index)
+
+    def test_choose_moves(self):
+        outputs = np.array([.1, .5, .5, .9, .2, .3])
+        offsets = np.array([0, 3, 4, 6])
+        choices = DumbNeuralNetMover().choose_moves(outputs, offsets)
+        self.assertEqual(list(choices), [1, 0, 1])
+        rng = np.random.RandomState(0)
+        for i in range(20):
+            choices = self.net.choose_moves(outputs, offsets, rng)
+            self.assertTrue(0 <= choices[0] < 3)
+            self.assertEqual(choices[1], 0)
+            self.assertTrue(0 <= choices[2] < 2)
+
+    def test_save_and_load_state(self):
+        path = os.path.join(tempfile.mkdtemp(), 'state.ckpt')
+        self.net.save_state(path)
+        net = NeuralNetMover()
+        net.load_state(path)
+        os.remove(path)
+        np.testing.assert_array_equal(net.feed_forward_boards(self.boards),
+                                      self.net.feed_forward_boards(self.boards))
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.net = NeuralNetMover()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assert_weights_equal(self, weights, expected, **kwargs):
+        for array, expected_array in zip(weights, expected):
+            np.testing.assert_allclose(array, expected_array, **kwargs)
+
+    def test_round_trip(self):
+        path = os.path.join(self.directory, 'state.ckpt')
+        save_checkpoint(path, self.net.weights())
+        self.assertEqual(os.path.getsize(path), 32 + (56*56 + 2*56 + 1)*8)
+        weights = load_checkpoint(path)
+        self.assert_weights_equal(weights, self.net.weights(), rtol=0)
+        self.assertTrue(isinstance(weights[0].base, np.memmap))
+        # Copy-on-write: training in memory leaves the file alone
+        weights[0][0, 0] += 1
+        self.assert_weights_equal(load_checkpoint(path), self.net.weights(),
+                                  rtol=0)
+
+    def test_save_over_loaded(self):
+        # The loaded weights map the file being replaced
+        path = os.path.join(self.directory, 'state.ckpt')
+        self.net.save_state(path)
+        self.net.load_state(path)
+        self.net.input_to_hidden_weights[0, 0] += 1
+        expected = [np.array(array) for array in self.net.weights()]
+        self.net.save_state(path)
+        self.assert_weights_equal(self.net.weights(), expected, rtol=0)
+        self.assert_weights_equal(load_checkpoint(path), expected, rtol=0)
+        self.assertEqual(os.listdir(self.directory), ['state.ckpt'])
+
+    def test_float32(self):
+        path = os.path.join(self.directory, 'state.ckpt')
+        save_checkpoint(path, self.net.weights(), dtype=np.float32)
+        self.assertEqual(os.path.getsize(path), 32 + (56*56 + 2*56 + 1)*4)
+        self.assertEqual(load_checkpoint(path)[0].dtype, np.float32)
+        self.assert_weights_equal(load_checkpoint(path), self.net.weights(),
+                                  rtol=1e-6)
+
+    def test_old_pickles(self):
+        path = os.path.join(self.directory, 'state.pkl')
+        shutil.copy('data/white_save_state_10400.pkl', path)
+        self.assertFalse(is_checkpoint(path))
+        self.net.load_state(path)
+        checkpoint_path = convert_pickle(path)
+        self.assertTrue(is_checkpoint(checkpoint_path))
+        self.assert_weights_equal(load_checkpoint(checkpoint_path),
+                                  self.net.weights(), rtol=0)
+
+    def test_bad_checkpoint(self):
+        path = os.path.join(self.directory, 'state.ckpt')
+        save_checkpoint(path, self.net.weights())
+        with open(path, 'r+b') as f:
+            f.truncate(100)
+        self.assertRaises(CheckpointError, load_checkpoint, path)
+
+
+class TestTrajectories(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'games.traj')
+        self.boards = random_boards(5)
+        self.games = [[(board, 1) for board in self.boards[:3]],
+                      [(board, -1) for board in self.boards[3:]]]
+        with TrajectoryWriter(self.path) as trajectories:
+            for game in self.games:
+                trajectories.append_game(game)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        records = read_trajectories(self.path)
+        self.assertEqual(len(records), 5)
+        for record, board in zip(records, self.boards):
+            self.assertEqual(CompactBoard.from_bytes(record['board'].tobytes()),
+                             board)
+        self.assertEqual(list(records['payoff']), [1, 1, 1, -1, -1])
+        self.assertEqual(list(records['game']), [0, 0, 0, 1, 1])
+
+    def test_append(self):
+        with TrajectoryWriter(self.path) as trajectories:
+            self.assertEqual(trajectories.append_game(self.games[0]), 2)
+        records = read_trajectories(self.path, start=4)
+        self.assertEqual(list(records['game']), [1, 2, 2, 2])
+
+    def test_not_a_trajectory_file(self):
+        path = os.path.join(self.directory, 'state.ckpt')
+        NeuralNetMover().save_state(path)
+        self.assertRaises(TrajectoryError, TrajectoryWriter, path)
+
+    def test_replay_buffer(self):
+        replay = ReplayBuffer(self.path, rng=np.random.RandomState(0))
+        self.assertEqual(len(replay), 5)
+        indexes, inputs, payoffs = replay.sample(50)
+        self.assertEqual(inputs.shape, (50, 56))
+        np.testing.assert_array_equal(payoffs, np.where(indexes < 3, 1, -1))
+        replay.update_priorities([0, 1, 2, 3], 0)
+        indexes, inputs, payoffs, weights = replay.sample_prioritized(20)
+        self.assertEqual(list(indexes), [4]*20)
+        np.testing.assert_array_equal(weights, np.ones(20))
+        with TrajectoryWriter(self.path) as trajectories:
+            trajectories.append_game(self.games[0])
+        replay.refresh()
+        self.assertEqual(len(replay), 8)
+        self.assertEqual(replay.priorities[5], 1)
+
+
+class TestGradients(unittest.TestCase):
+    def test_check_gradients(self):
+        random.seed(0)
+        np.random.seed(0)
+        net = NeuralNetMover()
+        net.load_state('data/white_save_state_10400.pkl')
+        boards = random_boards(2)
+        for board in boards:
+            analytic = net.gradients(boards_to_inputs([board]), np.ones(1))
+            numerical = net.numerical_gradients(board)
+            # Gradients are around 1e-6 and the numerical error around 1e-11;
+            # atol keeps near zero components from dominating
+            for a, n in zip(analytic, numerical):
+                np.testing.assert_allclose(a, n, rtol=1e-4, atol=1e-9)
+        self.assertEqual(sorted(check_gradients(net, boards)),
+                         sorted(GRADIENT_NAMES))
+
+    def test_backpropagate(self):
+        net = NeuralNetMover()
+        board = random_boards(1)[0]
+        output = net.feed_forward(board)
+        net.backpropagate(board, 1)
+        self.assertGreater(net.feed_forward(board), output)
+        output = net.feed_forward(board)
+        net.backpropagate(board, -1)
+        self.assertLess(net.feed_forward(board), output)
+
+
+class TestBatchTraining(unittest.TestCase):
+    def play_moves(self, net, boards):
+        for i, board in enumerate(boards):
+            net.save_move(i % 2 == 0, board)
+        net.record_outcome(True)
+
+    def copy_weights(self, source, target):
+        target.input_to_hidden_weights = source.input_to_hidden_weights.copy()
+        target.input_to_hidden_biases = source.input_to_hidden_biases.copy()
+        target.hidden_to_output_weights = \
+                source.hidden_to_output_weights.copy()
+        target.hidden_to_output_bias = source.hidden_to_output_bias
+
+    def test_batch_size_one_matches_sgd(self):
+        boards = random_boards(6)
+        online = NeuralNetMover()
+        batched = NeuralNetMover(games_per_update=1, batch_size=1)
+        self.copy_weights(online, batched)
+        self.play_moves(online, boards)
+        self.play_moves(batched, boards)
+        online.learn()
+        batched.learn()
+        np.testing.assert_allclose(batched.input_to_hidden_weights,
+                                   online.input_to_hidden_weights)
+        np.testing.assert_allclose(batched.hidden_to_output_weights,
+                                   online.hidden_to_output_weights)
+
+    def test_games_per_update(self):
+        boards = random_boards(4)
+        net = NeuralNetMover(games_per_update=2)
+        weights = net.input_to_hidden_weights.copy()
+        self.play_moves(net, boards)
+        net.learn()
+        np.testing.assert_array_equal(net.input_to_hidden_weights, weights)
+        self.assertEqual(len(net.pending_training), 4)
+        self.play_moves(net, boards)
+        net.learn()
+        self.assertFalse(np.array_equal(net.input_to_hidden_weights, weights))
+        self.assertEqual(net.pending_training, [])
+
+    def test_snapshot_starts_new_batch(self):
+        boards = random_boards(4)
+        net = NeuralNetMover(games_per_update=2)
+        self.play_moves(net, boards)
+        net.learn()
+        snapshot = net.snapshot()
+        self.assertEqual(snapshot.pending_training, [])
+        self.assertEqual(snapshot.pending_games, 0)
+        # A full batch of games is needed before the snapshot updates
+        weights = snapshot.input_to_hidden_weights.copy()
+        self.play_moves(snapshot, boards)
+        snapshot.learn()
+        np.testing.assert_array_equal(snapshot.input_to_hidden_weights,
+                                      weights)
+
+
+class TestEvaluationCache(unittest.TestCase):
+    def setUp(self):
+        board = CompactBoard(get_initial_board())
+        self.boards = generate_next_boards(board, False, [6, 5])
+
+    def test_hits(self):
+        net = DumbNeuralNetMover(evaluation_cache_size=1000)
+        expected = net.feed_forward_inputs(boards_to_inputs(self.boards))
+        np.testing.assert_array_equal(net.feed_forward_boards(self.boards),
+                                      expected)
+        np.testing.assert_array_equal(net.feed_forward_boards(self.boards),
+                                      expected)
+        self.assertEqual(net.feed_forward(self.boards[0].to_list()),
+                         expected[0])
+        # The list copy of a board hits its compact entry
+        info = net.evaluation_cache_info()
+        self.assertEqual(info.misses, len(self.boards))
+        self.assertEqual(info.hits, len(self.boards) + 1)
+        self.assertEqual(NeuralNetMover().evaluation_cache_info(), None)
+
+    def test_learn_invalidates(self):
+        net = NeuralNetMover(evaluation_cache_size=1000)
+        before = net.feed_forward_boards(self.boards)
+        for i, board in enumerate(self.boards):
+            net.save_move(i % 2 == 0, board)
+        net.record_outcome(True)
+        net.learn()
+        after = net.feed_forward_boards(self.boards)
+        np.testing.assert_array_equal(
+                after, net.feed_forward_inputs(boards_to_inputs(self.boards)))
+        self.assertFalse(np.array_equal(before, after))
+        self.assertEqual(net.evaluation_cache_info().hits, 0)
+
+    def test_bounded(self):
+        cache = EvaluationCache(4)
+        evaluate = lambda boards: np.arange(len(boards), dtype=float)
+        for board in self.boards:
+            cache.evaluate([board], 1, evaluate)
+            self.assertTrue(cache.info().currsize <= 4)
+        # The most recent boards survive
+        cache.evaluate(self.boards[-2:], 1, evaluate)
+        self.assertEqual(cache.info().hits, 2)
+
+
+class TestBearoffPlayer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        path = os.path.join(self.directory, 'bearoff.db')
+        expected_rolls, distributions = generate_database(2)
+        save_database(path, expected_rolls, distributions, 2)
+        self.database = BearoffDatabase(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_move(self):
+        board = get_blank_board()
+        board[18] = (0, 2)
+        board[0] = (1, 0)
+        board[WHITE_OFF_INDEX] = (0, 13)
+        board[BLACK_OFF_INDEX] = (14, 0)
+        board_list = generate_next_boards(board, False, [6, 1])
+        expected = self.database.best_move(False, board_list)
+        for net in [NeuralNetMover(bearoff_database=self.database),
+                    DumbNeuralNetMover(bearoff_database=self.database)]:
+            for i in range(5):
+                self.assertEqual(net.move(False, [6, 1], board, board_list),
+                                 expected)
+        black_board_list = generate_next_boards(swap_colors(board), True,
+                                                [6, 1])
+        net = DumbNeuralNetMover(bearoff_database=self.database)
+        self.assertEqual(
+                black_board_list[net.move(True, [6, 1], swap_colors(board),
+                                          black_board_list)],
+                swap_colors(board_list[expected]))
+        self.assertFalse(net.plays_bearoff(get_initial_board()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+'''
+Append-only on-disk store of self-play trajectories and a memory-mapped
+replay buffer over it.
+
+A trajectory file is a 16 byte header (magic 'GGTR', format version and
+record size) followed by fixed-width records, one per move:
+
+    * board: the 56 byte flattened board (see CompactBoard), seen from the
+      player who moved, as NeuralNetMover trains on it
+    * payoff: 1 if the player who moved won the game, -1 otherwise
+    * game: id of the game, counting up from 0 within the file
+'''
+import os
+import struct
+
+import numpy as np
+
+from backgammon.utility import CompactBoard
+
+MAGIC = b'GGTR'
+VERSION = 1
+HEADER = struct.Struct('<4sII')
+HEADER_SIZE = 16
+RECORD_DTYPE = np.dtype([('board', 'u1', (56,)),
+                         ('payoff', 'i1'),
+                         ('game', '<u4')])
+
+
+class TrajectoryError(Exception):
+    pass
+
+
+def _check_header(path):
+    with open(path, 'rb') as f:
+        header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise TrajectoryError('{} is truncated'.format(path))
+    magic, version, record_size = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise TrajectoryError('{} is not a trajectory file'.format(path))
+    if version != VERSION or record_size != RECORD_DTYPE.itemsize:
+        raise TrajectoryError('{} has unsupported version {}'.format(
+                path, version))
+
+def _record_count(path):
+    return (os.path.getsize(path) - HEADER_SIZE) // RECORD_DTYPE.itemsize
+
+
+class TrajectoryWriter(object):
+    '''
+    Appends games to the trajectory file at <path>, creating it if needed.
+    '''
+    def __init__(self, path):
+        self.path = path
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            _check_header(path)
+            records = read_trajectories(path)
+            self.next_game = int(records['game'][-1]) + 1 if len(records) else 0
+            self._file = open(path, 'ab')
+        else:
+            self.next_game = 0
+            self._file = open(path, 'wb')
+            header = HEADER.pack(MAGIC, VERSION, RECORD_DTYPE.itemsize)
+            self._file.write(header.ljust(HEADER_SIZE, b'\0'))
+
+    def append_game(self, training):
+        '''
+        Appends the (board, payoff) pairs of one game (see
+        BaseMoveTracker.training_pairs) and returns its game id.
+        '''
+        records = np.zeros(len(training), dtype=RECORD_DTYPE)
+        for i, (board, payoff) in enumerate(training):
+            records['board'][i] = np.frombuffer(CompactBoard(board).flat,
+                                                dtype=np.uint8)
+            records['payoff'][i] = payoff
+        records['game'] = self.next_game
+        self._file.write(records.tobytes())
+        self.next_game += 1
+        return self.next_game - 1
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_trajectories(path, start=0, stop=None):
+    '''
+    Memory-maps records [<start>, <stop>) of the trajectory file at <path>.
+    '''
+    _check_header(path)
+    count = _record_count(path)
+    stop = count if stop is None else min(stop, count)
+    if stop <= start:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.memmap(path, dtype=RECORD_DTYPE, mode='r',
+                     offset=HEADER_SIZE + start*RECORD_DTYPE.itemsize,
+                     shape=(stop - start,))
+
+
+class ReplayBuffer(object):
+    '''
+    Samples training boards from a trajectory file without loading it.
+
+    Sampling is uniform, or proportional to priority**alpha with
+    sample_prioritized().  Records start at priority 1.0; update_priorities()
+    changes them (e.g. to each board's training error).
+    '''
+    def __init__(self, path, alpha=.6, rng=np.random):
+        self.path = path
+        self.alpha = alpha
+        self.rng = rng
+        self.records = np.zeros(0, dtype=RECORD_DTYPE)
+        self.priorities = np.zeros(0)
+        self._cumulative = None
+        self.refresh()
+
+    def refresh(self):
+        '''
+        Maps records appended to the file since the buffer was opened.
+        '''
+        self.records = read_trajectories(self.path)
+        new_records = len(self.records) - len(self.priorities)
+        self.priorities = np.concatenate((self.priorities,
+                                          np.ones(new_records)))
+        self._cumulative = None
+
+    def __len__(self):
+        return len(self.records)
+
+    def batch(self, indexes):
+        '''
+        Returns the (inputs, payoffs) float arrays for the records at
+        <indexes>, ready for NeuralNetMover.gradients().
+        '''
+        records = self.records[indexes]
+        return (records['board'].astype(np.float64),
+                records['payoff'].astype(np.float64))
+
+    def sample(self, count):
+        '''
+        Returns (indexes, inputs, payoffs) for <count> records drawn
+        uniformly with replacement.
+        '''
+        indexes = np.sort(self.rng.randint(len(self.records), size=count))
+        inputs, payoffs = self.batch(indexes)
+        return indexes, inputs, payoffs
+
+    def sample_prioritized(self, count):
+        '''
+        Returns (indexes, inputs, payoffs, weights) for <count> records drawn
+        with probability proportional to priority**alpha.  <weights> are the
+        importance sampling weights correcting for it (largest is 1).
+        '''
+        if self._cumulative is None:
+            self._cumulative = np.cumsum(self.priorities ** self.alpha)
+        total = self._cumulative[-1]
+        thresholds = self.rng.random_sample(count) * total
+        indexes = np.searchsorted(self._cumulative, thresholds, side='right')
+        indexes = np.sort(np.minimum(indexes, len(self.records) - 1))
+        probabilities = self.priorities[indexes] ** self.alpha / total
+        weights = 1.0 / (len(self.records) * probabilities)
+        inputs, payoffs = self.batch(indexes)
+        return indexes, inputs, payoffs, weights / weights.max()
+
+    def update_priorities(self, indexes, priorities):
+        self.priorities[indexes] = priorities
+        self._cumulative = None
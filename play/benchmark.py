@@ -0,0 +1,264 @@
+'''
+Benchmarks move generation, network evaluation and whole games on a fixed,
+seeded corpus of positions, and writes the results as JSON so runs can be
+compared between commits.
+
+The corpus holds opening positions (every roll, both colors) and positions
+sampled from seeded random games: contact positions with non-double rolls,
+the same kind of positions with doubles, positions with a checker to enter
+from the bar and bear-off positions.
+
+Usage: python play/benchmark.py [--output benchmark.json]
+           [--compare old.json] [--positions 200] [--games 50] [--seed 0]
+'''
+
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+import subprocess
+
+import numpy as np
+
+from learn.random_mover import RandomMover
+from learn.neural_net import NeuralNetMover
+from backgammon.boards import (generate_next_boards, set_move_cache_size,
+                               clear_move_cache, DEFAULT_MOVE_CACHE_SIZE)
+from backgammon.utility import (get_initial_board, swap_colors, black_wins,
+                                white_wins, can_bear_off, CompactBoard,
+                                BLACK_BAR_INDEX, WHITE_BAR_INDEX,
+                                BLACK_INDEX, WHITE_INDEX)
+from play import play_game
+
+DEFAULT_OUTPUT_PATH = 'benchmark.json'
+POSITIONS_PER_CATEGORY = 200
+GAMES = 50
+REPEATS = 3
+CATEGORIES = ['opening', 'contact', 'doubles', 'bar_entry', 'bear_off']
+
+ALL_ROLLS = [[i, j] if i != j else [i, i, i, i]
+             for i in range(1, 7) for j in range(i, 7)]
+
+
+def build_corpus(positions=POSITIONS_PER_CATEGORY, seed=0):
+    '''
+    Returns {category: [(board, is_black_turn, roll), ...]}, the same for
+    the same <positions> and <seed>.
+    '''
+    rng = random.Random(seed)
+    initial_board = CompactBoard(get_initial_board())
+    corpus = dict((category, []) for category in CATEGORIES)
+    corpus['opening'] = [(initial_board, is_black_turn, roll)
+                         for is_black_turn in [False, True]
+                         for roll in ALL_ROLLS]
+    while any(len(corpus[category]) < positions
+              for category in CATEGORIES[1:]):
+        for board, is_black_turn in _random_game(rng):
+            category = _categorize(board, is_black_turn, rng)
+            if (category and len(corpus[category]) < positions and
+                    rng.random() < .25):
+                roll = _roll(rng, doubles=category == 'doubles')
+                corpus[category].append((board, is_black_turn, roll))
+    return corpus
+
+def _random_game(rng):
+    board = CompactBoard(get_initial_board())
+    is_black_turn = rng.random() < .5
+    while not black_wins(board) and not white_wins(board):
+        yield board, is_black_turn
+        next_boards = generate_next_boards(board, is_black_turn, _roll(rng))
+        # Successors come back in hash order; sort so choices are seeded
+        next_boards.sort(key=lambda next_board: next_board.to_bytes())
+        board = rng.choice(next_boards)
+        is_black_turn = not is_black_turn
+
+def _roll(rng, doubles=None):
+    die1 = rng.randint(1, 6)
+    die2 = rng.randint(1, 6)
+    if doubles is not None:
+        while (die1 == die2) != doubles:
+            die1 = rng.randint(1, 6)
+            die2 = rng.randint(1, 6)
+    if die1 == die2:
+        return [die1]*4
+    return [die1, die2]
+
+def _categorize(board, is_black_turn, rng):
+    mover = swap_colors(board) if is_black_turn else board
+    if mover[WHITE_BAR_INDEX][WHITE_INDEX] > 0:
+        return 'bar_entry'
+    if can_bear_off(mover):
+        return 'bear_off'
+    if _has_contact(mover):
+        return 'doubles' if rng.random() < .5 else 'contact'
+    return None
+
+def _has_contact(board):
+    '''
+    True while some white checker still has a black checker ahead of it.
+    '''
+    white_points = [-1 if board[WHITE_BAR_INDEX][WHITE_INDEX] else 24]
+    white_points += [point for point in range(24)
+                     if board[point][WHITE_INDEX]]
+    black_points = [24 if board[BLACK_BAR_INDEX][BLACK_INDEX] else -1]
+    black_points += [point for point in range(24)
+                     if board[point][BLACK_INDEX]]
+    return min(white_points) < max(black_points)
+
+
+def _best_time(function, repeats=REPEATS):
+    best = None
+    for i in range(repeats):
+        start_time = time.time()
+        function()
+        elapsed = time.time() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return max(best, 1e-9)
+
+def _peak_memory_mb():
+    # ru_maxrss is in kilobytes on Linux (bytes on OS X)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak /= 1024
+    return peak / 1024.0
+
+def benchmark_move_generation(corpus):
+    '''
+    Times uncached generate_next_boards over each category of the corpus.
+    '''
+    results = {}
+    set_move_cache_size(0)
+    try:
+        for category in CATEGORIES:
+            positions = corpus[category]
+            successors = sum(len(generate_next_boards(board, is_black_turn,
+                                                      roll))
+                             for board, is_black_turn, roll in positions)
+            elapsed = _best_time(lambda: [
+                    generate_next_boards(board, is_black_turn, roll)
+                    for board, is_black_turn, roll in positions])
+            results['boards.{}'.format(category)] = {
+                'positions_per_sec': len(positions) / elapsed,
+                'successors_per_sec': successors / elapsed,
+                'successors_per_position':
+                        float(successors) / len(positions),
+            }
+    finally:
+        set_move_cache_size(DEFAULT_MOVE_CACHE_SIZE)
+    return results
+
+def benchmark_feed_forward(corpus, seed=0):
+    '''
+    Scores the successors of every corpus position as move() does (one
+    batch per position), and board by board with feed_forward.
+    '''
+    np.random.seed(seed)
+    net = NeuralNetMover()
+    board_lists = []
+    for category in CATEGORIES:
+        for board, is_black_turn, roll in corpus[category]:
+            if is_black_turn:
+                board = swap_colors(board)
+            board_lists.append(generate_next_boards(board, False, roll))
+    boards = sum(len(board_list) for board_list in board_lists)
+    batched = _best_time(lambda: [net.feed_forward_boards(board_list)
+                                  for board_list in board_lists])
+    single_boards = [board for board_list in board_lists[:200]
+                     for board in board_list]
+    single = _best_time(lambda: [net.feed_forward(board)
+                                 for board in single_boards])
+    return {
+        'feed_forward_boards': {'boards_per_sec': boards / batched,
+                                'batches_per_sec': len(board_lists) / batched},
+        'feed_forward': {'boards_per_sec': len(single_boards) / single},
+    }
+
+def benchmark_games(games=GAMES, seed=0):
+    '''
+    Plays and learns from <games> full games per matchup (white is the
+    neural net in the NN matchup, as in training).
+    '''
+    results = {}
+    for name, white_type in [('random_vs_random', RandomMover),
+                             ('nn_vs_random', NeuralNetMover)]:
+        random.seed(seed)
+        np.random.seed(seed)
+        clear_move_cache()
+        black = RandomMover()
+        white = white_type()
+        start_time = time.time()
+        for i in range(games):
+            play_game(black, white)
+        elapsed = max(time.time() - start_time, 1e-9)
+        results[name] = {'games_per_sec': games / elapsed}
+    return results
+
+def run_benchmarks(positions=POSITIONS_PER_CATEGORY, games=GAMES, seed=0):
+    start_time = time.time()
+    corpus = build_corpus(positions, seed)
+    results = {}
+    results.update(benchmark_move_generation(corpus))
+    results.update(benchmark_feed_forward(corpus, seed))
+    results.update(benchmark_games(games, seed))
+    return {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'seed': seed,
+        'positions_per_category': dict((category, len(corpus[category]))
+                                       for category in CATEGORIES),
+        'games': games,
+        'results': results,
+        'peak_memory_mb': _peak_memory_mb(),
+        'seconds': time.time() - start_time,
+    }
+
+def _git_commit():
+    try:
+        with open('/dev/null', 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                           stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def report(run, baseline=None):
+    '''
+    Prints every metric of <run>, with the ratio to <baseline> if given.
+    '''
+    print '\nBenchmarks at {} ({:.1f} sec, {:.1f} MB peak)'.format(
+            run['commit'] or 'unknown commit', run['seconds'],
+            run['peak_memory_mb'])
+    for name in sorted(run['results']):
+        for metric in sorted(run['results'][name]):
+            value = run['results'][name][metric]
+            line = '{0:<32}{1:<28}{2:>14.1f}'.format(name, metric, value)
+            try:
+                old = baseline['results'][name][metric]
+                line += '{0:>9.2f}x'.format(value / old)
+            except (TypeError, KeyError, ZeroDivisionError):
+                pass
+            print line
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT_PATH)
+    parser.add_argument('--compare', help='earlier results to compare with')
+    parser.add_argument('--positions', type=int,
+                        default=POSITIONS_PER_CATEGORY)
+    parser.add_argument('--games', type=int, default=GAMES)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    run = run_benchmarks(args.positions, args.games, args.seed)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(run, baseline)
+    with open(args.output, 'w') as f:
+        json.dump(run, f, indent=1, sort_keys=True)
+    print 'Wrote results to {}'.format(args.output)
@@ -0,0 +1,94 @@
+'''
+Background checkpoint writer so saving player state never stalls play.
+
+Players are snapshotted in the calling thread and written by a writer
+thread (save_checkpoint renames a temporary file into place, so readers
+never see a partial checkpoint).  A failed write is raised by the next
+save() or close().  Older checkpoints of each series are pruned, keeping
+the last <keep_last> plus every <keep_every>th.
+'''
+
+import os
+import time
+import threading
+from Queue import Queue
+
+
+class CheckpointWriter(object):
+    def __init__(self, keep_last=None, keep_every=None):
+        '''
+        With <keep_last> None every checkpoint is kept.
+        '''
+        self.keep_last = keep_last
+        self.keep_every = keep_every
+        self.latencies = []
+        self.error = None
+        self._history = {}
+        self._queue = Queue()
+        self._thread = threading.Thread(target=self._write_checkpoints)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def save(self, player, path, series=None):
+        '''
+        Queues a snapshot of <player> to be saved to <path>.  Retention is
+        applied per <series> (defaults to the path's directory).  Raises
+        the error of an earlier checkpoint that failed to be written.
+        '''
+        if self.error is not None:
+            raise self.error
+        if series is None:
+            series = os.path.dirname(path)
+        self._queue.put((player.snapshot(), path, series))
+
+    def close(self):
+        '''
+        Waits for queued checkpoints to be written and stops the writer.
+        '''
+        self._queue.put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _write_checkpoints(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            snapshot, path, series = item
+            try:
+                self._write_checkpoint(snapshot, path, series)
+            except Exception as e:
+                if self.error is None:
+                    self.error = e
+
+    def _write_checkpoint(self, snapshot, path, series):
+        start_time = time.time()
+        snapshot.save_state(path)
+        if not os.path.exists(path):
+            # Players without state don't write anything
+            return
+        self.latencies.append(time.time() - start_time)
+        history = self._history.setdefault(series, [])
+        history.append(path)
+        self._prune(history)
+
+    def _prune(self, history):
+        if self.keep_last is None:
+            return
+        for index, path in enumerate(history[:-self.keep_last]):
+            if path is None:
+                continue
+            if self.keep_every and (index + 1) % self.keep_every == 0:
+                continue
+            if os.path.exists(path):
+                os.remove(path)
+            history[index] = None
+
+    def report_latency(self):
+        if not self.latencies:
+            return
+        print 'Wrote {0} checkpoints ({1:.1f} ms mean, {2:.1f} ms max)'.format(
+                len(self.latencies),
+                1000*sum(self.latencies)/len(self.latencies),
+                1000*max(self.latencies))
@@ -0,0 +1,161 @@
+'''
+Evaluation-only game runner.  Plays games across worker processes, each
+with its own seeded RNG and dice stream, without tracking moves, learning
+or saving checkpoints.
+
+evaluate_paired_games plays duplicate pairs instead: each game is played
+again with the same dice and the players' colors swapped, so the luck of
+the dice largely cancels within a pair.
+'''
+
+import time
+import random
+import multiprocessing
+
+from backgammon.dice import DiceStream
+from learn.evaluation_cache import EvaluationCacheInfo, hit_rate
+from play import (play_game_moves, report_game_rate, report_win_results,
+                  get_profiler)
+
+GAMES_PER_TASK = 64
+PAIRS_PER_TASK = GAMES_PER_TASK // 2
+
+
+def evaluate_games(count, black, white, processes=None, seed=None):
+    '''
+    Plays <count> games between fixed players and returns the number of
+    black wins.  Game chunks are seeded from <seed> (random if None) so
+    a seeded evaluation is reproducible for any number of processes (the
+    move cache returns boards in the same order as a fresh search, so a
+    worker's cache history doesn't change the players' choices).
+    '''
+    processes = processes or multiprocessing.cpu_count()
+    print 'Evaluating {} games of backgammon on {} processes...'.format(
+            count, processes)
+    seeds = random.Random(seed)
+    tasks = []
+    for start in range(0, count, GAMES_PER_TASK):
+        games = min(GAMES_PER_TASK, count - start)
+        tasks.append((black, white, games, seeds.randint(0, 2**31)))
+    black_wins = 0
+    games_played = 0
+    cache_infos = {}
+    start_time = time.time()
+    pool = multiprocessing.Pool(processes)
+    try:
+        for (task_black_wins, games, task_cache_infos,
+             profiles) in pool.imap_unordered(_evaluate_task, tasks):
+            black_wins += task_black_wins
+            games_played += games
+            if get_profiler():
+                get_profiler().add_games(profiles)
+            for color, info in task_cache_infos.items():
+                cache_infos[color] = _add_cache_info(cache_infos.get(color),
+                                                     info)
+            report_game_rate(games_played, time.time() - start_time)
+    finally:
+        pool.close()
+        pool.join()
+    report_win_results(black_wins, count - black_wins)
+    for color in sorted(cache_infos):
+        report_evaluation_cache(color, cache_infos[color])
+    if get_profiler():
+        get_profiler().finish()
+    return black_wins
+
+def _evaluate_task(task):
+    black, white, count, seed = task
+    random.seed(seed)
+    dice = DiceStream(seed)
+    black_wins = 0
+    for i in range(count):
+        black_wins += 1 if play_game_moves(black, white, False, dice) else 0
+    cache_infos = _cache_infos([('Black', black), ('White', white)])
+    profiler = get_profiler()
+    profiles = profiler.take_games() if profiler else []
+    return black_wins, count, cache_infos, profiles
+
+def evaluate_paired_games(pairs, first, second, processes=None, seed=None):
+    '''
+    Plays <pairs> duplicate pairs between fixed players and returns the
+    score of <first> in each pair: half a point per game won.  In the
+    first game of a pair <first> plays black; the second replays the same
+    dice stream (first turn and rolls) with <second> as black.  Seeded
+    like evaluate_games.
+    '''
+    if pairs < 1:
+        raise ValueError('Need at least one duplicate pair')
+    processes = processes or multiprocessing.cpu_count()
+    print 'Evaluating {} duplicate pairs of backgammon on {} ' \
+          'processes...'.format(pairs, processes)
+    seeds = random.Random(seed)
+    tasks = []
+    for start in range(0, pairs, PAIRS_PER_TASK):
+        task_pairs = min(PAIRS_PER_TASK, pairs - start)
+        tasks.append((first, second, task_pairs, seeds.randint(0, 2**31)))
+    pair_scores = []
+    cache_infos = {}
+    start_time = time.time()
+    pool = multiprocessing.Pool(processes)
+    try:
+        # imap keeps the scores in task order, so seeded runs match
+        for (task_scores, task_cache_infos,
+             profiles) in pool.imap(_evaluate_pairs_task, tasks):
+            pair_scores.extend(task_scores)
+            if get_profiler():
+                get_profiler().add_games(profiles)
+            for name, info in task_cache_infos.items():
+                cache_infos[name] = _add_cache_info(cache_infos.get(name),
+                                                    info)
+            report_game_rate(2*len(pair_scores), time.time() - start_time)
+    finally:
+        pool.close()
+        pool.join()
+    first_wins = int(round(2*sum(pair_scores)))
+    print 'First player wins: {0} of {1} games ({2:.2%})'.format(
+            first_wins, 2*pairs, first_wins / (2.0*pairs))
+    for name in sorted(cache_infos):
+        report_evaluation_cache(name, cache_infos[name])
+    if get_profiler():
+        get_profiler().finish()
+    return pair_scores
+
+def _evaluate_pairs_task(task):
+    first, second, count, seed = task
+    random.seed(seed)
+    dice = DiceStream(seed)
+    pair_scores = []
+    for i in range(count):
+        game_dice = dice.spawn(i)
+        first_wins = 1 if play_game_moves(first, second, False,
+                                          game_dice) else 0
+        first_wins += 0 if play_game_moves(second, first, False,
+                                           game_dice.replay()) else 1
+        pair_scores.append(first_wins / 2.0)
+    cache_infos = _cache_infos([('First', first), ('Second', second)])
+    profiler = get_profiler()
+    profiles = profiler.take_games() if profiler else []
+    return pair_scores, cache_infos, profiles
+
+def _cache_infos(players):
+    cache_infos = {}
+    for name, player in players:
+        info = getattr(player, 'evaluation_cache_info', lambda: None)()
+        if info is not None:
+            cache_infos[name] = info
+    return cache_infos
+
+def _add_cache_info(total, info):
+    '''
+    Sums the counts of the per-task caches (each task has its own copy).
+    '''
+    if total is None:
+        return info
+    return EvaluationCacheInfo(total.hits + info.hits,
+                               total.misses + info.misses,
+                               info.maxsize,
+                               max(total.currsize, info.currsize))
+
+def report_evaluation_cache(color, info):
+    print '{0} evaluation cache: {1:.1%} hits ({2} of {3} boards)'.format(
+            color, hit_rate(info), info.hits, info.hits + info.misses)
@@ -0,0 +1,117 @@
+'''
+Single process simulator that plays many evaluation games in lockstep.
+
+Every step rolls the dice for all running games in one call, generates the
+next boards of every game, and lets each neural net player score all of
+its games' candidates in one batched forward pass and pick its moves in
+bulk.  Other players fall back to one move() call per game.  Like
+evaluate.py, no moves are tracked and nothing is learned or saved.
+'''
+
+import time
+import random
+
+import numpy as np
+
+from learn.neural_net import NeuralNetMover
+from backgammon.boards import generate_next_boards
+from backgammon.batch import generate_next_boards_batch
+from backgammon.utility import (get_initial_board, black_wins, white_wins,
+                                swap_colors, CompactBoard)
+from play import report_game_rate, report_win_results
+
+DEFAULT_WIDTH = 64
+
+
+def play_games_lockstep(count, black, white, width=DEFAULT_WIDTH, seed=None):
+    '''
+    Plays <count> games keeping up to <width> of them running at once and
+    returns the number of black wins.  <seed> seeds the dice and the net
+    players' choices, and the random module for players that move one game
+    at a time.
+    '''
+    print 'Playing {} games of backgammon {} at a time...'.format(count, width)
+    rng = np.random.RandomState(seed)
+    if seed is not None:
+        random.seed(seed)
+    boards = []
+    turns = []
+    games_started = 0
+    black_game_wins = 0
+    white_game_wins = 0
+    start_time = time.time()
+    while games_started < count or boards:
+        # Keep the batch full
+        while games_started < count and len(boards) < width:
+            boards.append(CompactBoard(get_initial_board()))
+            turns.append(bool(rng.randint(2)))
+            games_started += 1
+        rolls = [[die1, die2] if die1 != die2 else [die1]*4
+                 for die1, die2 in rng.randint(1, 7, size=(len(boards), 2))
+                                      .tolist()]
+        next_boards = list(boards)
+        for player, is_black in [(black, True), (white, False)]:
+            games = [i for i, is_black_turn in enumerate(turns)
+                     if is_black_turn == is_black]
+            if games:
+                moves = _choose_moves(player, is_black,
+                                      [boards[i] for i in games],
+                                      [rolls[i] for i in games], rng)
+                for i, board in zip(games, moves):
+                    next_boards[i] = board
+        boards = []
+        next_turns = []
+        for board, is_black_turn in zip(next_boards, turns):
+            if black_wins(board):
+                black_game_wins += 1
+            elif white_wins(board):
+                white_game_wins += 1
+            else:
+                boards.append(board)
+                next_turns.append(not is_black_turn)
+        turns = next_turns
+    report_game_rate(count, time.time() - start_time)
+    report_win_results(black_game_wins, white_game_wins)
+    return black_game_wins
+
+def _choose_moves(player, is_black, boards, rolls, rng):
+    '''
+    Returns the board <player> moves to in each of its games.
+    '''
+    if not isinstance(player, NeuralNetMover):
+        return _move_each(player, is_black, boards, rolls)
+    # Bear-off races are looked up one by one (see NeuralNetMover.move)
+    races = [i for i, board in enumerate(boards)
+             if player.plays_bearoff(board)]
+    if races:
+        others = sorted(set(range(len(boards))) - set(races))
+        chosen = [None]*len(boards)
+        race_moves = _move_each(player, is_black,
+                                [boards[i] for i in races],
+                                [rolls[i] for i in races])
+        other_moves = _choose_moves(player, is_black,
+                                    [boards[i] for i in others],
+                                    [rolls[i] for i in others], rng)
+        for i, board in zip(races + others, race_moves + other_moves):
+            chosen[i] = board
+        return chosen
+    if not boards:
+        return []
+    # Successors are seen from the mover, as the net scores them
+    successors, offsets = generate_next_boards_batch(
+            boards, [is_black]*len(boards), rolls, mover_perspective=True)
+    outputs = player.feed_forward_inputs(successors.astype(np.float64))
+    choices = player.choose_moves(outputs, offsets, rng)
+    chosen = []
+    for offset, choice in zip(offsets[:-1], choices):
+        board = CompactBoard.from_bytes(successors[offset + choice].tobytes())
+        chosen.append(swap_colors(board) if is_black else board)
+    return chosen
+
+def _move_each(player, is_black, boards, rolls):
+    chosen = []
+    for board, roll in zip(boards, rolls):
+        board_list = generate_next_boards(board, is_black, roll)
+        index = player.move(is_black, roll, board, board_list)
+        chosen.append(board_list[index])
+    return chosen
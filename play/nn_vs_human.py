@@ -2,7 +2,7 @@
 Pits a trained neural net against a random mover and reports 99% confidence
 interval of true win rate of the neural net.
 
-Pass in path to the NN state pickle.
+Pass in path to the NN saved state (checkpoint or old pickle).
 '''
 
 import os
@@ -18,14 +18,14 @@ if __name__ == '__main__':
     black = DumbNeuralNetMover()
     white = HumanMover()
     if not len(sys.argv) == 2:
-        print 'Usage: python {} [path/to/NN.pkl]'.format(sys.argv[0])
+        print 'Usage: python {} [path/to/NN/state]'.format(sys.argv[0])
         sys.exit(0)
     load_path = sys.argv[1]
     if os.path.exists(load_path):
         print 'Loading white saved state found in {}'.format(load_path)
         black.load_state(load_path)
     else:
-        print 'Pickle file not found...'
+        print 'Saved state not found...'
         sys.exit(0)
     total_games = 1
     black_wins = play_games(total_games, black, white)
@@ -1,41 +1,183 @@
 import os
+import sys
 import time
 import random
+import multiprocessing
 
 from learn.random_mover import RandomMover
 from learn.neural_net import NeuralNetMover, DumbNeuralNetMover
-from backgammon.boards import generate_next_boards
+from backgammon.boards import generate_next_boards, sample_next_board
+from backgammon.dice import DiceStream
 from backgammon.utility import (get_initial_board, roll_dice, black_wins, 
-                                white_wins)
+                                white_wins, CompactBoard)
+from learn.trajectories import TrajectoryWriter
+from checkpoint_writer import CheckpointWriter
+from profiling import profiler_from_environment, GameProfiler, NullProfiler
 
-BLACK_SAVE_PATH = 'data/black_save_state_{}.pkl'
+BLACK_SAVE_PATH = 'data/black_save_state_{}.ckpt'
 BLACK_LOAD_PATH = 'black_load_me.pkl'
-WHITE_SAVE_PATH = 'data/white_save_state_{}.pkl'
+WHITE_SAVE_PATH = 'data/white_save_state_{}.ckpt'
 WHITE_LOAD_PATH = 'white_load_me.pkl'
 
 BLACK = 'black'
 WHITE = 'white'
 
-def play_games(count, black, white):
+CHECKPOINT_KEEP_LAST = 10
+CHECKPOINT_KEEP_EVERY = 10
+
+# Game loop profiler (see profiling.py), None when profiling is off
+_profiler = profiler_from_environment()
+_null_profiler = NullProfiler()
+
+def set_profiler(profiler):
+    global _profiler
+    _profiler = profiler
+
+def get_profiler():
+    return _profiler
+
+def play_games(count, black, white, trajectory_path=None):
+    '''
+    Plays and learns from <count> games, appending their moves to the
+    trajectory file at <trajectory_path> if given.
+    '''
     print 'Playing {} games of backgammon...'.format(count)
     black_wins = 0
     white_wins = 0
     start_time = time.time()
-    for i in range(count):
-        black_won = play_game(black, white)
-        black_wins += 1 if black_won else 0
-        white_wins += 0 if black_won else 1
-        if i % 100 == 99:
-            black.save_state(BLACK_SAVE_PATH.format(i+1))
-            white.save_state(WHITE_SAVE_PATH.format(i+1))
-        if i % 10 == 9 or i == 0:
-            elapsed_time = time.time() - start_time
-            report_game_rate(i+1, elapsed_time)
+    checkpoints = CheckpointWriter(CHECKPOINT_KEEP_LAST, CHECKPOINT_KEEP_EVERY)
+    trajectories = TrajectoryWriter(trajectory_path) if trajectory_path else None
+    try:
+        for i in range(count):
+            black_won = play_game(black, white, trajectories)
+            black_wins += 1 if black_won else 0
+            white_wins += 0 if black_won else 1
+            if i % 100 == 99:
+                save_checkpoints(checkpoints, black, white, i+1)
+            if i % 10 == 9 or i == 0:
+                elapsed_time = time.time() - start_time
+                report_game_rate(i+1, elapsed_time)
+        _flush_training(black, white)
+    finally:
+        checkpoints.close()
+        if trajectories:
+            trajectories.close()
+    elapsed_time = time.time() - start_time
+    report_game_rate(count, elapsed_time)
+    report_win_results(black_wins, white_wins)
+    checkpoints.report_latency()
+    if _profiler:
+        _profiler.finish()
+    return black_wins
+
+def save_checkpoints(checkpoints, black, white, games):
+    # Checkpoints include the games held back for a batched update
+    _flush_training(black, white)
+    checkpoints.save(black, BLACK_SAVE_PATH.format(games), BLACK)
+    checkpoints.save(white, WHITE_SAVE_PATH.format(games), WHITE)
+
+def play_games_parallel(count, black, white, processes=None,
+                        games_per_sync=None, trajectory_path=None):
+    '''
+    Self-play farm version of play_games.  Worker processes play games with
+    a snapshot of <black> and <white> and send back each game's boards and
+    outcome; the players here learn from them in order.  Players are sent
+    to the workers again (with their updated weights) every
+    <games_per_sync> games.
+    '''
+    processes = processes or multiprocessing.cpu_count()
+    games_per_sync = games_per_sync or 10 * processes
+    print 'Playing {} games of backgammon on {} processes...'.format(
+            count, processes)
+    black_wins = 0
+    white_wins = 0
+    start_time = time.time()
+    # Fork the workers before the checkpoint writer thread starts
+    pool = multiprocessing.Pool(processes)
+    checkpoints = CheckpointWriter(CHECKPOINT_KEEP_LAST, CHECKPOINT_KEEP_EVERY)
+    trajectories = TrajectoryWriter(trajectory_path) if trajectory_path else None
+    try:
+        while black_wins + white_wins < count:
+            sync_games = min(games_per_sync, count - black_wins - white_wins)
+            # Workers only play, so send copies without pending training
+            # or evaluation caches
+            black_snapshot = black.snapshot()
+            white_snapshot = white.snapshot()
+            tasks = [(black_snapshot, white_snapshot, worker_games,
+                      random.randint(0, 2**31))
+                     for worker_games in _split_games(sync_games, processes)]
+            for games, profiles in pool.imap(_play_worker_games, tasks):
+                for game, (black_moves, white_moves, black_won) in \
+                        enumerate(games):
+                    if _profiler:
+                        _profiler.add_games(profiles[game:game+1])
+                    _learn_from_game(black, black_moves, white_moves, black_won,
+                                     trajectories)
+                    _learn_from_game(white, black_moves, white_moves, black_won)
+                    black_wins += 1 if black_won else 0
+                    white_wins += 0 if black_won else 1
+                    i = black_wins + white_wins - 1
+                    if i % 100 == 99:
+                        save_checkpoints(checkpoints, black, white, i+1)
+                    if i % 10 == 9 or i == 0:
+                        elapsed_time = time.time() - start_time
+                        report_game_rate(i+1, elapsed_time)
+        _flush_training(black, white)
+    finally:
+        pool.close()
+        pool.join()
+        checkpoints.close()
+        if trajectories:
+            trajectories.close()
     elapsed_time = time.time() - start_time
     report_game_rate(count, elapsed_time)
     report_win_results(black_wins, white_wins)
+    checkpoints.report_latency()
+    if _profiler:
+        _profiler.finish()
     return black_wins
 
+def _flush_training(*players):
+    for player in players:
+        player.flush_training()
+
+def _split_games(count, processes):
+    share, extra = divmod(count, processes)
+    games = [share + 1 if i < extra else share for i in range(processes)]
+    return [worker_games for worker_games in games if worker_games]
+
+def _play_worker_games(task):
+    '''
+    Plays games in a worker process without learning.  Returns a
+    (black moves, white moves, black won) trajectory per game and the
+    games' profiles (empty unless profiling).
+    '''
+    black, white, count, seed = task
+    random.seed(seed)
+    dice = DiceStream(seed)
+    trajectories = []
+    for i in range(count):
+        black.reset_move_tracking()
+        white.reset_move_tracking()
+        black_won = play_game_moves(black, white, dice=dice)
+        trajectories.append((black.black_moves, black.white_moves, black_won))
+    profiles = _profiler.take_games() if _profiler else []
+    return trajectories, profiles
+
+def _learn_from_game(player, black_moves, white_moves, black_won,
+                     trajectories=None):
+    player.black_moves = list(black_moves)
+    player.white_moves = list(white_moves)
+    player.record_outcome(black_won)
+    if trajectories:
+        trajectories.append_game(player.training_pairs())
+    _learn(player)
+
+def _learn(player):
+    start_time = time.time()
+    player.learn()
+    (_profiler or _null_profiler).record('learn', time.time() - start_time)
+
 def report_win_results(black_wins, white_wins):
     count = black_wins + white_wins
     print '\nBlack wins: {0} ({1:.2f}%)'.format(
@@ -52,32 +194,74 @@ def report_game_rate(games, elapsed):
     print '\nRan {0} games in {1:.2f} sec ({2:.2f} {3})'.format(
             games, elapsed, game_rate, description)
  
-def play_game(black, white):
-    is_black_turn = random.choice([True, False])
-    board = get_initial_board()
+def play_game(black, white, trajectories=None, dice=None):
+    black_won = play_game_moves(black, white, dice=dice)
+    black.record_outcome(black_won)
+    if trajectories:
+        trajectories.append_game(black.training_pairs())
+    _learn(black)
+    white.record_outcome(black_won)
+    _learn(white)
+    return black_won
+
+def play_game_moves(black, white, track_moves=True, dice=None):
+    '''
+    Plays one game, letting both players track the moves (unless
+    <track_moves> is False), and returns whether black won.  Doesn't record
+    the outcome or learn.  The first turn and the rolls come from the
+    DiceStream <dice> if given, else from the global random module.  A
+    RandomMover's turn calls sample_next_board in place of
+    generate_next_boards and move().  Each phase of every turn is timed
+    into the profiler, if one is set.
+    '''
+    profiler = _profiler or _null_profiler
+    clock = time.time
+    samples = {True: isinstance(black, RandomMover),
+               False: isinstance(white, RandomMover)}
+    profiler.start_game()
+    game_start = clock()
+    if dice is None:
+        is_black_turn = random.choice([True, False])
+        roll_next = roll_dice
+    else:
+        is_black_turn = dice.black_starts()
+        roll_next = dice.roll
+    board = CompactBoard(get_initial_board())
     while not black_wins(board) and not white_wins(board):
-        roll = roll_dice()
-        boards = generate_next_boards(board, is_black_turn, roll)
-        if is_black_turn:
-            board_index = black.move(is_black_turn, roll, board, boards)
-        else: 
-            board_index = white.move(is_black_turn, roll, board, boards)
-        board = boards[board_index]
-        black.save_move(is_black_turn, board)
-        white.save_move(is_black_turn, board)
+        start = clock()
+        roll = roll_next()
+        rolled = clock()
+        profiler.record('roll', rolled - start)
+        if samples[is_black_turn]:
+            board = sample_next_board(board, is_black_turn, roll)
+            profiler.record('sample_next_board', clock() - rolled)
+            profiler.record_turn()
+        else:
+            player = black if is_black_turn else white
+            boards = generate_next_boards(board, is_black_turn, roll)
+            generated = clock()
+            board = boards[player.move(is_black_turn, roll, board, boards)]
+            moved = clock()
+            profiler.record('generate_next_boards', generated - rolled)
+            profiler.record('move', moved - generated)
+            profiler.record_turn(len(boards))
+        if track_moves:
+            start = clock()
+            black.save_move(is_black_turn, board)
+            white.save_move(is_black_turn, board)
+            profiler.record('save_move', clock() - start)
         is_black_turn = not is_black_turn
+    profiler.end_game(clock() - game_start)
     black_won = black_wins(board)
     white_won = white_wins(board)
     assert black_won or white_won
     assert not (black_won and white_won)
-    black.record_outcome(black_won)
-    black.learn()
-    white.record_outcome(black_won)
-    white.learn()
-    return black_wins(board)
+    return black_won
+
+# Two-sided 99% normal quantile
+Z = 2.5759
 
 def report_confidence_interval(games, wins, protag_desc, antag_desc):
-    Z = 2.5759
     E = Z/(2*(games)**.5)
     observed_wins = float(wins)/games
     win_floor = max(0.0, observed_wins - E)
@@ -86,7 +270,30 @@ def report_confidence_interval(games, wins, protag_desc, antag_desc):
            'in interval [{2:.4f}, {3:.4f}]').format(
                    protag_desc, antag_desc, win_floor, win_ceil)
 
+def report_paired_confidence_interval(pair_scores, protag_desc, antag_desc):
+    '''
+    Like report_confidence_interval for duplicate pairs, each scored as the
+    protagonist's share of its two wins (0, .5 or 1).  The pairs are
+    independent but their two games are not, so the interval comes from
+    the sample variance of the pair scores rather than a binomial bound.
+    '''
+    pairs = len(pair_scores)
+    observed_wins = float(sum(pair_scores))/pairs
+    variance = (sum((score - observed_wins)**2 for score in pair_scores) /
+                max(pairs - 1, 1))
+    E = Z*(variance/pairs)**.5
+    win_floor = max(0.0, observed_wins - E)
+    win_ceil = min(1.0, observed_wins + E)
+    print ('99% chance that the true win percentage of {0} against {1} is '
+           'in interval [{2:.4f}, {3:.4f}] ({4} duplicate pairs; a binomial '
+           'bound over the same {5} games would be +/-{6:.4f})').format(
+                   protag_desc, antag_desc, win_floor, win_ceil, pairs,
+                   2*pairs, Z/(2*(2*pairs)**.5))
+
 if __name__ == '__main__':
+    if '--profile' in sys.argv:
+        sys.argv.remove('--profile')
+        set_profiler(GameProfiler())
     black = RandomMover()
     if os.path.exists(BLACK_LOAD_PATH):
         print 'Loading black saved state found in {}'.format(BLACK_LOAD_PATH)
@@ -95,4 +302,7 @@ if __name__ == '__main__':
     if os.path.exists(WHITE_LOAD_PATH):
         print 'Loading white saved state found in {}'.format(WHITE_LOAD_PATH)
         white.load_state(WHITE_LOAD_PATH)
-    play_games(10000, black, white)
+    if len(sys.argv) == 2:
+        play_games_parallel(10000, black, white, int(sys.argv[1]))
+    else:
+        play_games(10000, black, white)
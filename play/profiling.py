@@ -0,0 +1,148 @@
+'''
+Per-phase timing of the game loop.
+
+Set GAMMON_PROFILE to a JSON path (or to 1 for game_profile.json) and
+play_games, play_games_parallel and evaluate_games time every dice roll,
+generate_next_boards call (counting the successors), move(), save_move()
+and learn(), and the sample_next_board call that replaces generating and
+moving on a RandomMover's turn.  They print a summary table when done and
+dump the totals plus one record per game to the JSON file.  Profiling is
+off otherwise and nothing is recorded.
+'''
+
+import os
+import json
+
+PROFILE_ENV = 'GAMMON_PROFILE'
+DEFAULT_PROFILE_PATH = 'game_profile.json'
+PHASES = ['roll', 'generate_next_boards', 'sample_next_board', 'move',
+          'save_move', 'learn']
+
+
+def profiler_from_environment():
+    '''
+    Returns a GameProfiler if GAMMON_PROFILE is set, else None.
+    '''
+    path = os.environ.get(PROFILE_ENV)
+    if not path or path == '0':
+        return None
+    return GameProfiler(DEFAULT_PROFILE_PATH if path == '1' else path)
+
+
+class NullProfiler(object):
+    '''
+    Stands in for a GameProfiler when profiling is off, so the game loop
+    times its phases into a profiler that records nothing.
+    '''
+    def start_game(self):
+        pass
+
+    def record(self, phase, seconds):
+        pass
+
+    def record_turn(self, successors=0):
+        pass
+
+    def end_game(self, seconds):
+        pass
+
+
+class GameProfiler(object):
+    '''
+    Collects one record per game: seconds and calls per phase, turns,
+    successors generated and the game's total seconds.
+    '''
+    def __init__(self, path=DEFAULT_PROFILE_PATH):
+        self.path = path
+        self.games = []
+
+    def start_game(self):
+        self.games.append({
+            'turns': 0,
+            'seconds': 0.0,
+            'successors': 0,
+            'phases': dict((phase, {'calls': 0, 'seconds': 0.0})
+                           for phase in PHASES),
+        })
+
+    def record(self, phase, seconds):
+        '''
+        Adds a call of <phase> to the game started last (learn() runs after
+        the game loop).
+        '''
+        counts = self.games[-1]['phases'][phase]
+        counts['calls'] += 1
+        counts['seconds'] += seconds
+
+    def record_turn(self, successors=0):
+        '''
+        Counts a turn and the successors generated on it (none when the
+        next board was sampled).
+        '''
+        self.games[-1]['turns'] += 1
+        self.games[-1]['successors'] += successors
+
+    def end_game(self, seconds):
+        self.games[-1]['seconds'] = seconds
+
+    def take_games(self):
+        '''
+        Returns and forgets the records so far (workers send them back to
+        be merged with add_games).
+        '''
+        games = self.games
+        self.games = []
+        return games
+
+    def add_games(self, games):
+        self.games.extend(games)
+
+    def summary(self):
+        phases = dict((phase, {'calls': 0, 'seconds': 0.0})
+                      for phase in PHASES)
+        for game in self.games:
+            for phase in PHASES:
+                phases[phase]['calls'] += game['phases'][phase]['calls']
+                phases[phase]['seconds'] += game['phases'][phase]['seconds']
+        return {
+            'games': len(self.games),
+            'turns': sum(game['turns'] for game in self.games),
+            'successors': sum(game['successors'] for game in self.games),
+            'seconds': sum(game['seconds'] for game in self.games),
+            'phases': phases,
+        }
+
+    def report(self):
+        summary = self.summary()
+        if not summary['games']:
+            return
+        # learn() runs outside the game loop, so it adds to the game time
+        total = summary['seconds'] + summary['phases']['learn']['seconds']
+        generated = summary['phases']['generate_next_boards']
+        print '\nProfile of {0} games ({1} turns, {2:.1f} successors per ' \
+              'generated turn):'.format(summary['games'], summary['turns'],
+                                        float(summary['successors']) /
+                                        max(generated['calls'], 1))
+        print '{0:<22}{1:>10}{2:>12}{3:>14}{4:>8}'.format(
+                'phase', 'calls', 'seconds', 'usec/call', '%')
+        for phase in PHASES:
+            counts = summary['phases'][phase]
+            print '{0:<22}{1:>10}{2:>12.3f}{3:>14.1f}{4:>8.1f}'.format(
+                    phase, counts['calls'], counts['seconds'],
+                    1e6 * counts['seconds'] / max(counts['calls'], 1),
+                    100 * counts['seconds'] / max(total, 1e-9))
+        if generated['calls']:
+            print '{0:.0f} successors per second generated'.format(
+                    summary['successors'] / max(generated['seconds'], 1e-9))
+
+    def dump(self, path=None):
+        path = path or self.path
+        with open(path, 'w') as f:
+            json.dump({'summary': self.summary(), 'games': self.games}, f,
+                      indent=1, sort_keys=True)
+        print 'Wrote game profile to {}'.format(path)
+
+    def finish(self):
+        self.report()
+        if self.games:
+            self.dump()
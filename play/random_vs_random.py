@@ -1,6 +1,10 @@
 '''
 Pits a random mover against another random mover and reports 99% confidence
 interval of true win rate of the neural net.
+
+Optionally pass in the number of games and of worker processes, and
+--paired to play them as duplicate pairs (see evaluate.py; an odd game is
+dropped).
 '''
 
 import os
@@ -8,17 +12,30 @@ import sys
 
 from learn.random_mover import RandomMover
 from learn.neural_net import DumbNeuralNetMover
-from play import play_games, report_confidence_interval
+from play import report_confidence_interval, report_paired_confidence_interval
+from evaluate import evaluate_games, evaluate_paired_games
 
 
 if __name__ == '__main__':
+    paired = '--paired' in sys.argv
+    if paired:
+        sys.argv.remove('--paired')
     black = RandomMover()
     white = RandomMover()
-    total_games = 1024
-    black_wins = play_games(total_games, black, white)
-    white_wins = total_games - black_wins
+    total_games = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else None
     nn_desc = 'Random Mover 1'
     random_desc = 'Random Mover 2'
+    if paired:
+        if total_games < 2:
+            print 'Paired evaluation needs at least 2 games (one pair)'
+            sys.exit(0)
+        pair_scores = evaluate_paired_games(total_games // 2, white, black,
+                                            processes)
+        report_paired_confidence_interval(pair_scores, nn_desc, random_desc)
+        sys.exit(0)
+    black_wins = evaluate_games(total_games, black, white, processes)
+    white_wins = total_games - black_wins
     report_confidence_interval(total_games, white_wins, nn_desc, random_desc)
 
 
@@ -0,0 +1,287 @@
+import os
+import sys
+import json
+import time
+import random
+from StringIO import StringIO
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from learn.neural_net import NeuralNetMover, DumbNeuralNetMover
+from learn.random_mover import RandomMover
+from learn.trajectories import TrajectoryWriter
+from learn.gradient_check import random_boards
+from checkpoint_writer import CheckpointWriter
+from train_offline import shuffled_batches, train
+from profiling import GameProfiler
+from play import (play_game, play_games, play_games_parallel, play_game_moves,
+                  set_profiler)
+import evaluate
+from lockstep import play_games_lockstep
+from evaluate import (evaluate_games, evaluate_paired_games,
+                      _evaluate_pairs_task)
+from benchmark import build_corpus, run_benchmarks, CATEGORIES
+from backgammon.dice import DiceStream
+from backgammon.utility import (swap_colors, can_bear_off, WHITE_BAR_INDEX,
+                                WHITE_INDEX)
+
+
+class TestCheckpointWriter(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, games):
+        return os.path.join(self.directory, 'state_{}.ckpt'.format(games))
+
+    def test_snapshot(self):
+        net = NeuralNetMover()
+        weights = net.input_to_hidden_weights.copy()
+        checkpoints = CheckpointWriter()
+        checkpoints.save(net, self.path(1))
+        net.input_to_hidden_weights += 1
+        checkpoints.close()
+        self.assertEqual(len(checkpoints.latencies), 1)
+        net.load_state(self.path(1))
+        np.testing.assert_array_equal(net.input_to_hidden_weights, weights)
+        self.assertEqual(os.listdir(self.directory), ['state_1.ckpt'])
+
+    def test_retention(self):
+        net = NeuralNetMover()
+        checkpoints = CheckpointWriter(keep_last=2, keep_every=3)
+        for games in range(1, 9):
+            checkpoints.save(net, self.path(games))
+            checkpoints.save(RandomMover(), self.path(games) + '.random')
+        checkpoints.close()
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['state_3.ckpt', 'state_6.ckpt', 'state_7.ckpt',
+                          'state_8.ckpt'])
+
+    def test_error(self):
+        net = NeuralNetMover()
+        checkpoints = CheckpointWriter()
+        checkpoints.save(net, os.path.join(self.directory, 'missing',
+                                           'state.ckpt'))
+        # Wait for the writer thread to fail
+        for i in range(500):
+            if checkpoints.error is not None:
+                break
+            time.sleep(.01)
+        self.assertRaises(IOError, checkpoints.save, net, self.path(2))
+        self.assertRaises(IOError, checkpoints.close)
+
+
+class TestTrainOffline(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.paths = []
+        boards = random_boards(10)
+        for name in ['a.traj', 'b.traj']:
+            path = os.path.join(self.directory, name)
+            with TrajectoryWriter(path) as trajectories:
+                for game in range(10):
+                    trajectories.append_game(
+                            [(board, 1 if game % 2 else -1) for board in boards])
+            self.paths.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_shuffled_batches(self):
+        # 200 records through a 30 record buffer in chunks of 16
+        batches = list(shuffled_batches(self.paths, batch_size=8,
+                                        buffer_size=30, chunk_size=16,
+                                        rng=np.random.RandomState(0)))
+        all_inputs = np.concatenate([batch[0] for batch in batches])
+        all_payoffs = np.concatenate([batch[1] for batch in batches])
+        self.assertEqual(all_inputs.shape, (200, 56))
+        self.assertEqual(sum(all_payoffs), 0)
+        self.assertTrue(all(len(batch[1]) == 8 for batch in batches))
+        self.assertNotEqual(list(all_payoffs[:10]), [-1]*10)
+
+    def test_train(self):
+        net = NeuralNetMover()
+        weights = net.input_to_hidden_weights.copy()
+        self.assertEqual(train(net, self.paths, epochs=2, batch_size=16), 400)
+        self.assertFalse(np.array_equal(net.input_to_hidden_weights, weights))
+
+
+class TestPlayGameDice(unittest.TestCase):
+    def test_replay(self):
+        dice = DiceStream(11)
+        games = []
+        for stream in [dice, dice.replay()]:
+            random.seed(0)
+            black = RandomMover()
+            white = RandomMover()
+            black_won = play_game_moves(black, white, dice=stream)
+            games.append((black_won, black.black_moves, black.white_moves))
+        self.assertEqual(games[0], games[1])
+        self.assertTrue(len(games[0][1]) + len(games[0][2]) > 10)
+
+    def test_duplicate_pairs(self):
+        # Identical players replaying the same dice with colors swapped
+        # play the same game twice, so every pair is split
+        np.random.seed(0)
+        first = DumbNeuralNetMover()
+        np.random.seed(0)
+        second = DumbNeuralNetMover()
+        pair_scores, cache_infos, profiles = _evaluate_pairs_task(
+                (first, second, 3, 5))
+        self.assertEqual(pair_scores, [.5, .5, .5])
+        scores = _evaluate_pairs_task((RandomMover(), RandomMover(), 20, 5))[0]
+        self.assertEqual(_evaluate_pairs_task(
+                (RandomMover(), RandomMover(), 20, 5))[0], scores)
+        self.assertTrue(set(scores) <= set([0, .5, 1]))
+        self.assertRaises(ValueError, evaluate_paired_games, 0,
+                          RandomMover(), RandomMover())
+
+
+def _quietly(function, *args, **kwargs):
+    '''
+    Returns what <function> returns and what it printed.
+    '''
+    stdout = sys.stdout
+    sys.stdout = output = StringIO()
+    try:
+        return function(*args, **kwargs), output.getvalue()
+    finally:
+        sys.stdout = stdout
+
+
+class CountingMover(RandomMover):
+    def __init__(self):
+        RandomMover.__init__(self)
+        self.games_learned = 0
+
+    def learn(self):
+        RandomMover.learn(self)
+        self.games_learned += 1
+
+
+class TestPlayGames(unittest.TestCase):
+    def test_parallel(self):
+        black = CountingMover()
+        white = CountingMover()
+        black_wins, report = _quietly(play_games_parallel, 7, black, white,
+                                      processes=2, games_per_sync=4)
+        self.assertEqual(black.games_learned, 7)
+        self.assertEqual(white.games_learned, 7)
+        self.assertTrue('Playing 7 games of backgammon on 2 processes' in report)
+        self.assertTrue('Black wins: {} '.format(black_wins) in report)
+        self.assertTrue('White wins: {} '.format(7 - black_wins) in report)
+
+    def test_flushes_training(self):
+        # The fourth game waits for a batched update that never comes
+        white = NeuralNetMover(games_per_update=3)
+        play_games(4, RandomMover(), white)
+        self.assertEqual(white.pending_training, [])
+        self.assertEqual(white.pending_games, 0)
+
+
+class TestEvaluate(unittest.TestCase):
+    def setUp(self):
+        # Several small tasks, so workers see them in different orders
+        self.games_per_task = evaluate.GAMES_PER_TASK
+        evaluate.GAMES_PER_TASK = 6
+
+    def tearDown(self):
+        evaluate.GAMES_PER_TASK = self.games_per_task
+
+    def test_reproducible_across_processes(self):
+        np.random.seed(0)
+        net = NeuralNetMover()
+        black_wins = [evaluate_games(120, RandomMover(), net, processes,
+                                     seed=1)
+                      for processes in [1, 2, 1]]
+        self.assertEqual(black_wins[0], black_wins[1])
+        self.assertEqual(black_wins[0], black_wins[2])
+        self.assertTrue(0 < black_wins[0] < 120)
+
+
+class TestLockstep(unittest.TestCase):
+    def test_seeded(self):
+        np.random.seed(0)
+        net = DumbNeuralNetMover()
+        for black_type in [RandomMover, DumbNeuralNetMover]:
+            black = black_type()
+            results = [_quietly(play_games_lockstep, 12, black, net,
+                                width=5, seed=5)
+                       for i in range(2)]
+            black_wins, report = results[0]
+            self.assertEqual(results[1][0], black_wins)
+            self.assertTrue(0 <= black_wins <= 12)
+            self.assertTrue('Black wins: {} '.format(black_wins) in report)
+            self.assertTrue('White wins: {} '.format(12 - black_wins)
+                            in report)
+
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.profiler = GameProfiler(os.path.join(self.directory,
+                                                  'profile.json'))
+        set_profiler(self.profiler)
+
+    def tearDown(self):
+        set_profiler(None)
+        shutil.rmtree(self.directory)
+
+    def test_phases(self):
+        for i in range(3):
+            play_game(RandomMover(), DumbNeuralNetMover())
+        summary = self.profiler.summary()
+        self.assertEqual(summary['games'], 3)
+        phases = summary['phases']
+        for phase in ['roll', 'save_move']:
+            self.assertEqual(phases[phase]['calls'], summary['turns'])
+        # Black's next boards are sampled, white's generated and chosen
+        generated = phases['generate_next_boards']['calls']
+        self.assertEqual(phases['move']['calls'], generated)
+        self.assertEqual(phases['sample_next_board']['calls'] + generated,
+                         summary['turns'])
+        self.assertTrue(phases['sample_next_board']['calls'] > 0)
+        self.assertEqual(phases['learn']['calls'], 6)
+        self.assertTrue(summary['successors'] >= generated)
+        self.assertTrue(0 < phases['generate_next_boards']['seconds'] <
+                        summary['seconds'])
+        self.profiler.dump()
+        with open(self.profiler.path) as f:
+            dumped = json.load(f)
+        self.assertEqual(dumped['summary']['turns'], summary['turns'])
+        self.assertEqual(len(dumped['games']), 3)
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_corpus(self):
+        corpus = build_corpus(10, seed=1)
+        self.assertEqual(build_corpus(10, seed=1), corpus)
+        self.assertEqual(len(corpus['opening']), 42)
+        for category in CATEGORIES[1:]:
+            self.assertEqual(len(corpus[category]), 10)
+            for board, is_black_turn, roll in corpus[category]:
+                mover = swap_colors(board) if is_black_turn else board
+                on_bar = mover[WHITE_BAR_INDEX][WHITE_INDEX] > 0
+                self.assertEqual(on_bar, category == 'bar_entry')
+                if category == 'bear_off':
+                    self.assertTrue(can_bear_off(mover))
+                if category in ['contact', 'doubles']:
+                    self.assertEqual(len(roll) == 4, category == 'doubles')
+
+    def test_run(self):
+        run = run_benchmarks(positions=3, games=1)
+        results = run['results']
+        self.assertTrue(results['boards.contact']['successors_per_sec'] > 0)
+        self.assertTrue(results['feed_forward_boards']['boards_per_sec'] > 0)
+        self.assertTrue(results['nn_vs_random']['games_per_sec'] > 0)
+        self.assertTrue(run['peak_memory_mb'] > 0)
+        json.dumps(run)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+'''
+Trains a neural net on self-play trajectories recorded to disk (see
+learn/trajectories.py and the trajectory_path argument of play_games).
+
+Records are streamed from the memory-mapped files in chunks and shuffled
+through a bounded buffer, so memory use doesn't depend on the size of the
+data set.
+'''
+
+import time
+import argparse
+
+import numpy as np
+
+from learn.neural_net import NeuralNetMover
+from learn.trajectories import read_trajectories, RECORD_DTYPE
+
+BATCH_SIZE = 256
+BUFFER_SIZE = 65536
+CHUNK_SIZE = 8192
+
+
+def stream_records(paths, chunk_size=CHUNK_SIZE):
+    '''
+    Yields the records of the trajectory files at <paths>, in order, as
+    arrays of up to <chunk_size> records.
+    '''
+    for path in paths:
+        start = 0
+        while True:
+            records = read_trajectories(path, start, start + chunk_size)
+            if not len(records):
+                break
+            yield np.array(records)
+            start += len(records)
+
+def shuffled_batches(paths, batch_size=BATCH_SIZE, buffer_size=BUFFER_SIZE,
+                     chunk_size=CHUNK_SIZE, rng=np.random):
+    '''
+    Yields (inputs, payoffs) batches covering every record once.  Records
+    are shuffled within a buffer of about <buffer_size> records.
+    '''
+    buffer = np.zeros(0, dtype=RECORD_DTYPE)
+    for records in stream_records(paths, chunk_size):
+        buffer = np.concatenate((buffer, records))
+        if len(buffer) < buffer_size + batch_size:
+            continue
+        buffer = buffer[rng.permutation(len(buffer))]
+        emit = (len(buffer) - buffer_size) // batch_size * batch_size
+        for start in range(0, emit, batch_size):
+            yield _batch(buffer[start:start + batch_size])
+        buffer = buffer[emit:]
+    buffer = buffer[rng.permutation(len(buffer))]
+    for start in range(0, len(buffer), batch_size):
+        yield _batch(buffer[start:start + batch_size])
+
+def _batch(records):
+    return (records['board'].astype(np.float64),
+            records['payoff'].astype(np.float64))
+
+def train(net, paths, epochs=1, batch_size=BATCH_SIZE,
+          buffer_size=BUFFER_SIZE, rng=np.random):
+    '''
+    Runs <epochs> passes of mini-batch gradient updates over the recorded
+    trajectories and returns the number of boards trained on.
+    '''
+    boards = 0
+    for epoch in range(epochs):
+        start_time = time.time()
+        epoch_boards = 0
+        for inputs, payoffs in shuffled_batches(paths, batch_size,
+                                                buffer_size, rng=rng):
+            net.apply_gradients(net.gradients(inputs, payoffs), net.STEP_SIZE)
+            epoch_boards += len(payoffs)
+        elapsed_time = time.time() - start_time
+        print 'Epoch {0}: {1} boards in {2:.2f} sec ({3:.0f} boards/sec)'.format(
+                epoch + 1, epoch_boards, elapsed_time,
+                epoch_boards / max(elapsed_time, 1e-9))
+        boards += epoch_boards
+    return boards
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('save_path', help='where to save the trained net')
+    parser.add_argument('trajectories', nargs='+',
+                        help='trajectory files to train on')
+    parser.add_argument('--load', help='saved state to start from')
+    parser.add_argument('--epochs', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--buffer-size', type=int, default=BUFFER_SIZE)
+    parser.add_argument('--step-size', type=float, default=.01)
+    args = parser.parse_args()
+    net = NeuralNetMover(step_size=args.step_size)
+    if args.load:
+        print 'Loading saved state found in {}'.format(args.load)
+        net.load_state(args.load)
+    train(net, args.trajectories, args.epochs, args.batch_size,
+          args.buffer_size)
+    net.save_state(args.save_path)
+    print 'Saved trained net to {}'.format(args.save_path)